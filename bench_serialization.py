@@ -0,0 +1,168 @@
+"""
+序列化路径基准：比较改造前的路径（dict 请求体、创作者返回 dict 或 json.dumps 字符串、
+路由中 json.loads 后由默认 JSON 编码器输出）与当前路径（类型化模型经 pydantic 直接序列化、gzip）
+每个请求的 CPU 时间。结果保存（内容哈希）单独列出，不计入序列化对比。
+LLM 调用被替换为固定响应，只测量服务端的解析与序列化开销。
+
+用法：python bench_serialization.py [请求数]
+"""
+import asyncio
+import json
+import logging
+import sys
+import time
+from typing import Optional, Tuple
+
+import httpx
+from fastapi import FastAPI
+from fastapi.middleware.cors import CORSMiddleware
+from pydantic import BaseModel
+
+import main
+from llm_base import LLMBase, LLMConfig
+from llm_pipeline import PipelineCreator
+from llm_portrait_creator import PortraitCreator
+from unified_logging import backend_logger as logger
+
+ELEMENTS_TEXT = (
+    "### 肖像画作品的结构化描述\n\n#### 1. 主体（Subject）\n该作品描绘了一位中年的亚洲男性，形象凝聚着执着这一概念。" * 20
+)
+REFLECTION_RESPONSE = json.dumps({
+    "concept": "执着",
+    "elements": {
+        "subject": "坚定的眼神和微微前倾的姿态" * 20,
+        "meaning": "面对生活挑战时坚持信念的象征" * 20,
+        "interaction": "在变幻莫测的社会中寻找自身定位的当代观众" * 20,
+        "style": "波普艺术，鲜艳的色彩与夸张的图形" * 20,
+        "medium": "丙烯颜料与喷漆，画布为基础" * 20
+    }
+}, ensure_ascii=False)
+FINAL_RESPONSE = '```json\n{"en_prompt": "portrait of a determined middle-aged asian man, pop art", "zh_prompt": "执着的中年亚洲男性肖像，波普艺术"}\n```'
+
+
+async def fake_call_llm(self, messages: list, stage: Optional[str] = None, deadline: Optional[float] = None) -> str:
+    if "Stable Diffusion" in messages[0]["content"]:
+        return FINAL_RESPONSE
+    return REFLECTION_RESPONSE
+
+
+class LegacyPortraitCreator(LLMBase):
+    """
+    改造前的肖像创作者：f-string 拼接提示词，反思结果以 dict 返回，最终提示词以 json.dumps 字符串返回。
+    提示词文本取自当前阶段声明，与改造前一致。
+    """
+    call_llm = fake_call_llm
+
+    def __init__(self, config: LLMConfig):
+        super().__init__(config)
+        self.stages = {stage.name: stage for stage in PortraitCreator.stages}
+
+    async def generate(self, input_data: BaseModel) -> str:
+        raise NotImplementedError
+
+    def _messages(self, stage_name: str, **values) -> list:
+        stage = self.stages[stage_name]
+        return [
+            {"role": "system", "content": stage.system_prompt},
+            {"role": "user", "content": stage.user_prompt.format(**values)}
+        ]
+
+    async def reflect_on_elements(self, concept: str, elements: str) -> dict:
+        try:
+            self.logger.info("反思肖像描述")
+            response = await self.call_llm(self._messages("reflection", concept=concept, elements=elements))
+            self.logger.info(f"完成反思: {response}")
+            return self.format_llm_response(response)
+        except Exception as e:
+            self.logger.error(f"反思肖像描述时出错：{e}", exc_info=True)
+            return {"error": "处理过程中出现未知错误", "details": str(e)}
+
+    async def generate_final_prompts(self, elements: str) -> str:
+        try:
+            self.logger.info("生成最终提示词...")
+            response = await self.call_llm(self._messages("final_prompts", reflection=elements))
+            self.logger.info(f"成功生成最终提示词: {response}")
+            return json.dumps(self.format_llm_response(response))
+        except Exception as e:
+            self.logger.error(f"生成最终提示词时出错：{e}", exc_info=True)
+            return json.dumps({"error": str(e)})
+
+
+def build_legacy_app() -> FastAPI:
+    # 复现改造前的路由：dict 请求体，最终提示词先 json.dumps 再 json.loads，最后由默认编码器输出
+    legacy = FastAPI()
+    legacy.add_middleware(
+        CORSMiddleware,
+        allow_origins=["http://localhost:3000"],
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    creator = LegacyPortraitCreator(main.llm_config)
+
+    @legacy.post("/api/reflect-on-portrait-elements")
+    async def reflect(data: dict):
+        logger.info(f"收到反思请求：{data}")
+        reflected_elements = await creator.reflect_on_elements(data.get('concept', ''), data.get('elements', ''))
+        logger.info(f"成功反思画作描述")
+        return {"reflection": reflected_elements}
+
+    @legacy.post("/api/generate-final-portrait-prompts")
+    async def final(data: dict):
+        logger.info(f"收到生成最终提示词的请求：{data}")
+        prompts = await creator.generate_final_prompts(data['elements'])
+        logger.info(f"成功生成最终提示词: {prompts}")
+        return {"prompts": json.loads(prompts)}
+
+    return legacy
+
+
+async def measure(app: FastAPI, path: str, body: dict, requests: int, gzip: bool, rounds: int = 5) -> Tuple[float, int]:
+    """
+    直接通过 ASGI 调用应用，返回多轮中最小的单请求 CPU 时间（毫秒）及响应体传输字节数。
+    """
+    headers = {"Accept-Encoding": "gzip" if gzip else "identity"}
+    transport = httpx.ASGITransport(app=app)
+    best = float("inf")
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        response = await client.post(path, json=body, headers=headers)
+        await response.aread()
+        for _ in range(rounds):
+            started = time.process_time()
+            for _ in range(requests):
+                await client.post(path, json=body, headers=headers)
+            best = min(best, (time.process_time() - started) / requests * 1000)
+    return best, response.num_bytes_downloaded
+
+
+async def run(requests: int):
+    PipelineCreator.call_llm = fake_call_llm
+    # 日志输出不属于序列化路径，基准期间关闭
+    logging.getLogger("backend").disabled = True
+    for creator in (main.portrait_creator, main.sculpture_creator):
+        creator.pipeline.cache = None
+
+    reflect_body = {"concept": "执着", "elements": {"elements": ELEMENTS_TEXT}}
+    final_body = {"elements": json.loads(REFLECTION_RESPONSE)}
+    legacy = build_legacy_app()
+    store_results = main.result_response
+
+    print(f"{'route':<40}{'before':>20}{'after':>20}{'after+store':>20}{'after+store+gzip':>20}")
+    for path, body in [
+        ("/api/reflect-on-portrait-elements", reflect_body),
+        ("/api/generate-final-portrait-prompts", final_body)
+    ]:
+        before = await measure(legacy, path, body, requests, gzip=False)
+        # 不保存结果时路由直接返回模型，由 response_model 序列化
+        main.result_response = lambda model: model
+        try:
+            after = await measure(main.app, path, body, requests, gzip=False)
+        finally:
+            main.result_response = store_results
+        stored = await measure(main.app, path, body, requests, gzip=False)
+        compressed = await measure(main.app, path, body, requests, gzip=True)
+        print(path.ljust(40) + "".join(f"{ms:>10.3f} ms{size:>6} B" for ms, size in (before, after, stored, compressed)))
+
+
+if __name__ == "__main__":
+    asyncio.run(run(int(sys.argv[1]) if len(sys.argv) > 1 else 500))
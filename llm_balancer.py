@@ -0,0 +1,277 @@
+import asyncio
+import random
+import time
+from typing import Dict, List, Optional
+
+import httpx
+from pydantic import BaseModel
+
+from llm_resilience import CircuitBreaker, CircuitOpenError, UpstreamGuard, is_upstream_failure
+from unified_logging import backend_logger as logger
+
+
+class LLMBackend(BaseModel):
+    """一个兼容 OpenAI 接口的后端：地址、模型、权重及独立连接池大小。"""
+    name: str
+    api_url: str
+    model: str
+    api_key: Optional[str] = None
+    weight: float = 1.0
+    max_connections: int = 20
+    # 单次请求的超时；由流水线调用时还会被缩短到阶段剩余时间以内
+    timeout: float = 45.0
+    health_url: Optional[str] = None
+
+
+class BackendState:
+    """后端的运行时状态：连接池、在途请求数、延迟 EWMA 及健康状况。"""
+
+    def __init__(self, backend: LLMBackend, guard: UpstreamGuard, default_api_key: str):
+        self.backend = backend
+        self.guard = guard
+        self.api_key = backend.api_key or default_api_key
+        self.outstanding = 0
+        self.latency_ewma: Optional[float] = None
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+        self._client: Optional[httpx.AsyncClient] = None
+
+    @property
+    def name(self) -> str:
+        return self.backend.name
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        # 每个后端各自复用一个连接池，首次使用时创建
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                timeout=self.backend.timeout,
+                limits=httpx.Limits(max_connections=self.backend.max_connections)
+            )
+        return self._client
+
+    @property
+    def headers(self) -> dict:
+        return {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+
+    @property
+    def health_url(self) -> str:
+        if self.backend.health_url:
+            return self.backend.health_url
+        return self.backend.api_url.rsplit("/chat/completions", 1)[0] + "/models"
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def available(self, now: float) -> bool:
+        # 熔断器打开满恢复时间后视为可用，使该后端能被选中并发出半开探测请求
+        return now >= self.ejected_until and self.guard.breaker.ready()
+
+    def effective_weight(self, strategy: str, default_latency: float) -> float:
+        # 配置权重按在途请求数（及延迟 EWMA）折算，越忙、越慢的后端被选中的概率越低
+        weight = self.backend.weight / (self.outstanding + 1)
+        if strategy == "latency_ewma":
+            weight /= self.latency_ewma if self.latency_ewma is not None else default_latency
+        return weight
+
+    def snapshot(self, now: float) -> dict:
+        return {
+            "model": self.backend.model,
+            "weight": self.backend.weight,
+            "healthy": now >= self.ejected_until,
+            "outstanding": self.outstanding,
+            "latency_ewma_ms": round(self.latency_ewma * 1000, 1) if self.latency_ewma is not None else None,
+            "requests": self.requests,
+            "failures": self.failures,
+            "ejections": self.ejections,
+            **self.guard.snapshot()
+        }
+
+
+class LoadBalancer:
+    """
+    在多个后端之间分配请求：按阶段亲和规则筛选候选后端，再按权重除以在途请求数
+    （latency_ewma 策略再除以延迟 EWMA）加权随机选择；被动与主动健康检查负责摘除和恢复后端。
+    """
+
+    def __init__(
+        self,
+        backends: List[BackendState],
+        stage_routes: Optional[Dict[str, List[str]]] = None,
+        strategy: str = "least_outstanding",
+        ewma_alpha: float = 0.3,
+        eject_threshold: int = 3,
+        eject_duration: float = 30.0,
+        max_attempts: int = 2,
+        min_retry_budget: float = 5.0
+    ):
+        if not backends:
+            raise ValueError("至少需要配置一个 LLM 后端")
+        self.backends = {state.name: state for state in backends}
+        for stage, names in (stage_routes or {}).items():
+            unknown = [name for name in names if name not in self.backends]
+            if unknown:
+                raise ValueError(f"阶段 {stage} 的路由中包含未定义的后端：{', '.join(unknown)}")
+        self.stage_routes = stage_routes or {}
+        self.strategy = strategy
+        self.ewma_alpha = ewma_alpha
+        self.eject_threshold = eject_threshold
+        self.eject_duration = eject_duration
+        self.max_attempts = max_attempts
+        self.min_retry_budget = min_retry_budget
+        self._health_task: Optional[asyncio.Task] = None
+
+    def candidates(self, stage: Optional[str]) -> List[BackendState]:
+        # 阶段名形如 "portrait.final_prompts"，先匹配完整名称，再匹配阶段名
+        names = None
+        if stage:
+            names = self.stage_routes.get(stage) or self.stage_routes.get(stage.rsplit(".", 1)[-1])
+        if not names:
+            return list(self.backends.values())
+        return [self.backends[name] for name in names if name in self.backends]
+
+    def choose(self, stage: Optional[str], exclude: Optional[set] = None) -> BackendState:
+        now = time.monotonic()
+        pool = [state for state in self.candidates(stage) if state.name not in (exclude or set())]
+        healthy = [state for state in pool if state.available(now)]
+        # 全部后端都不健康时仍从候选中选择，由熔断器决定是否快速失败
+        pool = healthy or pool
+        if not pool:
+            raise RuntimeError(f"阶段 {stage} 没有可用的 LLM 后端")
+        # 尚无延迟数据的后端按已知最快的后端对待，以便尽快采样
+        known = [state.latency_ewma for state in pool if state.latency_ewma is not None]
+        default_latency = min(known) if known else 1.0
+        weights = [state.effective_weight(self.strategy, default_latency) for state in pool]
+        return random.choices(pool, weights=weights)[0]
+
+    async def complete(self, messages: list, stage: Optional[str] = None, deadline: Optional[float] = None) -> str:
+        """
+        发送请求，上游失败时换一个后端重试。deadline 为调用方的截止时间（time.monotonic()），
+        每次请求的超时被缩短到剩余时间以内，剩余时间不足 min_retry_budget 时不再重试。
+        """
+        tried = set()
+        # 至少尝试一次，没有候选后端时由 choose 抛出明确的错误
+        attempts = max(1, min(self.max_attempts, len(self.candidates(stage))))
+        for attempt in range(attempts):
+            state = self.choose(stage, exclude=tried)
+            tried.add(state.name)
+            # 在限流队列中等待的请求也计入在途数，使最少在途路由能感知排队
+            state.outstanding += 1
+            try:
+                return await state.guard.call(lambda: self._post(state, messages, deadline))
+            except Exception as e:
+                retryable = is_upstream_failure(e) or isinstance(e, CircuitOpenError)
+                if not retryable or attempt == attempts - 1:
+                    raise
+                if deadline is not None and deadline - time.monotonic() < self.min_retry_budget:
+                    logger.warning(f"后端 {state.name} 请求失败，剩余时间不足，不再重试：{e}")
+                    raise
+                logger.warning(f"后端 {state.name} 请求失败，切换后端重试：{e}")
+            finally:
+                state.outstanding -= 1
+
+    async def _post(self, state: BackendState, messages: list, deadline: Optional[float] = None) -> str:
+        payload = {
+            "model": state.backend.model,
+            "messages": messages
+        }
+
+        state.requests += 1
+        started = time.monotonic()
+        try:
+            # 在限流队列中等待后才计算剩余时间，使上游超时先于调用方的截止时间触发并被记录
+            timeout = state.backend.timeout
+            if deadline is not None:
+                timeout = max(min(timeout, deadline - time.monotonic()), 0.001)
+            response = await state.client.post(
+                state.backend.api_url, json=payload, headers=state.headers, timeout=timeout
+            )
+            response.raise_for_status()
+            result = response.json()
+            content = result['choices'][0]['message']['content']
+        except httpx.HTTPStatusError as e:
+            logger.error(f"HTTP error occurred: {e}")
+            self._record_failure(state, e)
+            raise
+        except Exception as e:
+            logger.error(f"An unexpected error occurred: {e}")
+            self._record_failure(state, e)
+            raise
+
+        self._record_success(state, time.monotonic() - started)
+        return content
+
+    def _record_success(self, state: BackendState, latency: float):
+        if state.latency_ewma is None:
+            state.latency_ewma = latency
+        else:
+            state.latency_ewma = self.ewma_alpha * latency + (1 - self.ewma_alpha) * state.latency_ewma
+        state.consecutive_failures = 0
+        state.ejections = 0
+
+    def _record_failure(self, state: BackendState, error: Exception):
+        state.failures += 1
+        if not is_upstream_failure(error):
+            return
+        state.consecutive_failures += 1
+        if state.consecutive_failures >= self.eject_threshold:
+            self._eject(state)
+
+    def _eject(self, state: BackendState):
+        # 连续被摘除时摘除时间指数增长，最长 10 倍
+        duration = self.eject_duration * min(2 ** state.ejections, 10)
+        state.ejections += 1
+        state.consecutive_failures = 0
+        state.ejected_until = time.monotonic() + duration
+        logger.warning(f"摘除后端 {state.name}，{duration:.0f} 秒后恢复")
+
+    async def check_health(self):
+        """
+        主动健康检查：探测失败的后端被摘除；已摘除或已熔断的后端探测成功后立即恢复，
+        熔断器转为半开，由下一次实际请求确认是否关闭。
+        """
+        for state in self.backends.values():
+            try:
+                response = await state.client.get(state.health_url, headers=state.headers, timeout=10.0)
+                healthy = response.is_success
+            except httpx.HTTPError:
+                healthy = False
+            now = time.monotonic()
+            if healthy and (now < state.ejected_until or state.guard.breaker.state == CircuitBreaker.OPEN):
+                state.ejected_until = 0.0
+                state.ejections = 0
+                state.guard.breaker.half_open()
+                logger.info(f"后端 {state.name} 健康检查通过，重新接入")
+            elif not healthy and now >= state.ejected_until:
+                self._eject(state)
+
+    async def _health_loop(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.check_health()
+            except Exception as e:
+                logger.error(f"后端健康检查出错：{e}", exc_info=True)
+
+    def start_health_checks(self, interval: float):
+        if self._health_task is None or self._health_task.done():
+            self._health_task = asyncio.ensure_future(self._health_loop(interval))
+
+    async def close(self):
+        if self._health_task is not None:
+            self._health_task.cancel()
+            self._health_task = None
+        for state in self.backends.values():
+            await state.close()
+
+    def snapshot(self) -> dict:
+        now = time.monotonic()
+        return {name: state.snapshot(now) for name, state in self.backends.items()}
@@ -1,11 +1,11 @@
-import os
 from abc import ABC, abstractmethod
-from typing import Dict, Any
-import httpx
+from typing import Dict, List, Optional
 from dotenv import load_dotenv
 from pydantic import BaseModel, Field
 import json
 import re
+from llm_balancer import BackendState, LLMBackend, LoadBalancer
+from llm_resilience import create_guard
 from unified_logging import backend_logger as logger
 
 load_dotenv()
@@ -14,40 +14,120 @@ class LLMConfig(BaseModel):
     api_key: str = Field(..., env='OPENROUTER_API_KEY')
     api_url: str = "https://openrouter.ai/api/v1/chat/completions"
     model: str = "openai/gpt-4o-mini-2024-07-18"
+    # 自适应并发限制与熔断器参数
+    initial_concurrency: int = 4
+    min_concurrency: int = 1
+    max_concurrency: int = 64
+    latency_threshold: float = 30.0
+    failure_threshold: int = 5
+    recovery_timeout: float = 30.0
+    # 多后端负载均衡：未配置 backends 时使用上面的 api_url 和 model 作为唯一后端
+    backends: List[LLMBackend] = []
+    stage_routes: Dict[str, List[str]] = {}
+    routing_strategy: str = "least_outstanding"
+    eject_threshold: int = 3
+    eject_duration: float = 30.0
+    health_check_interval: float = 30.0
+
+    def resolved_backends(self) -> List[LLMBackend]:
+        if self.backends:
+            return self.backends
+        return [LLMBackend(name="default", api_url=self.api_url, model=self.model)]
+
+_balancers: Dict[str, LoadBalancer] = {}
+
+def get_balancer(config: LLMConfig) -> LoadBalancer:
+    """
+    取得与配置对应的共享负载均衡器，使相同配置的创作者共用连接池、健康状态、并发限制和熔断器。
+    """
+    key = config.model_dump_json()
+    if key not in _balancers:
+        states = [
+            BackendState(
+                backend,
+                create_guard(
+                    backend.name,
+                    initial_concurrency=config.initial_concurrency,
+                    min_concurrency=config.min_concurrency,
+                    max_concurrency=config.max_concurrency,
+                    latency_threshold=config.latency_threshold,
+                    failure_threshold=config.failure_threshold,
+                    recovery_timeout=config.recovery_timeout
+                ),
+                config.api_key
+            )
+            for backend in config.resolved_backends()
+        ]
+        _balancers[key] = LoadBalancer(
+            states,
+            stage_routes=config.stage_routes,
+            strategy=config.routing_strategy,
+            eject_threshold=config.eject_threshold,
+            eject_duration=config.eject_duration
+        )
+    return _balancers[key]
 
 class LLMBase(ABC):
     def __init__(self, config: LLMConfig):
         self.config = config
         self.logger = logger
+        self.balancer = get_balancer(config)
+
+    async def call_llm(self, messages: list, stage: Optional[str] = None, deadline: Optional[float] = None) -> str:
+        return await self.balancer.complete(messages, stage=stage, deadline=deadline)
+
+    @abstractmethod
+    async def generate(self, input_data: BaseModel) -> BaseModel:
+        pass
 
-    async def call_llm(self, messages: list) -> str:
-        headers = {
-            "Authorization": f"Bearer {self.config.api_key}",
-            "Content-Type": "application/json"
-        }
+    @staticmethod
+    def format_llm_response(response: str) -> dict:
+        """
+        格式化 LLM 返回的响应，确保它是一个有效的 JSON 对象。
+        """
+        # 移除可能的 markdown 代码块标记
+        response = re.sub(r'```json\s*', '', response)
+        response = re.sub(r'\s*```', '', response)
 
-        payload = {
-            "model": self.config.model,
-            "messages": messages
-        }
+        # 尝试直接解析 JSON
+        try:
+            parsed_response = json.loads(response)
+            if isinstance(parsed_response, dict) and ('en_prompt' in parsed_response or 'zh_prompt' in parsed_response):
+                return {
+                    'en': parsed_response.get('en_prompt', ''),
+                    'zh': parsed_response.get('zh_prompt', '')
+                }
+            return parsed_response
+        except json.JSONDecodeError:
+            pass
 
+        # 如果直接解析失败，尝试提取并解析嵌套的 JSON
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.post(self.config.api_url, json=payload, headers=headers)
-            response.raise_for_status()
-            result = response.json()
-            return result['choices'][0]['message']['content']
-        except httpx.HTTPStatusError as e:
-            self.logger.error(f"HTTP error occurred: {e}")
-            raise
-        except Exception as e:
-            self.logger.error(f"An unexpected error occurred: {e}")
-            raise
+            match = re.search(r'\{.*\}', response, re.DOTALL)
+            if match:
+                parsed_response = json.loads(match.group())
+                if isinstance(parsed_response, dict) and ('en_prompt' in parsed_response or 'zh_prompt' in parsed_response):
+                    return {
+                        'en': parsed_response.get('en_prompt', ''),
+                        'zh': parsed_response.get('zh_prompt', '')
+                    }
+                return parsed_response
+        except json.JSONDecodeError:
+            pass
 
-    @abstractmethod
-    async def generate(self, input_data: Dict[str, Any]) -> str:
-        pass
+        # 如果仍然失败，尝试将响应转换为字典格式
+        cleaned_response = re.sub(r'(\w+):', r'"\1":', response)
+        cleaned_response = cleaned_response.replace("'", '"')
+        try:
+            parsed_response = json.loads(f'{{{cleaned_response}}}')
+            if isinstance(parsed_response, dict) and ('en_prompt' in parsed_response or 'zh_prompt' in parsed_response):
+                return {
+                    'en': parsed_response.get('en_prompt', ''),
+                    'zh': parsed_response.get('zh_prompt', '')
+                }
+            return parsed_response
+        except json.JSONDecodeError:
+            pass
 
-    def format_llm_response(self, response: str) -> dict:
-        # ... (保持原有的 format_llm_response 方法实现)
-        pass
+        # 如果所有尝试都失败，返回原始响应作为字符串值的字典
+        return {"raw": response}
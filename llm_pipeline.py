@@ -0,0 +1,370 @@
+import asyncio
+import hashlib
+import inspect
+import json
+import logging
+import sys
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+import httpx
+from pydantic import BaseModel, ConfigDict
+
+from llm_base import LLMBase, LLMConfig
+from llm_resilience import CircuitOpenError
+from sd_payload import DEFAULT_TARGET, build_payload
+
+
+# 阶段超时的兜底余量：上游请求按阶段截止时间超时，asyncio 超时稍后才触发
+STAGE_TIMEOUT_GRACE = 1.0
+
+
+class Reflection(BaseModel):
+    """反思阶段的结果。LLM 未按格式返回时，原始内容保留在额外字段（如 raw）中。"""
+    model_config = ConfigDict(extra="allow")
+
+    concept: Optional[str] = None
+    elements: Optional[Union[Dict[str, Any], str]] = None
+    error: Optional[str] = None
+    details: Optional[str] = None
+
+    def is_complete(self) -> bool:
+        # 解析失败时 format_llm_response 回退为 {"raw": ...}，此时没有 elements
+        return not self.error and self.elements is not None and "raw" not in (self.model_extra or {})
+
+
+class FinalPrompts(BaseModel):
+    """最终的 SD 提示词；提供创作设定时附带本地组装的完整 SD 请求体。"""
+    model_config = ConfigDict(extra="allow")
+
+    en: str = ""
+    zh: str = ""
+    target: Optional[str] = None
+    payload: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+
+    def is_complete(self) -> bool:
+        return not self.error and bool(self.en) and "raw" not in (self.model_extra or {})
+
+
+def is_complete(result: Any) -> bool:
+    """阶段结果是否按格式解析成功；只有完整的结果才会被缓存。"""
+    if isinstance(result, (Reflection, FinalPrompts)):
+        return result.is_complete()
+    return bool(result)
+
+
+def parse_reflection(response: str) -> Reflection:
+    return Reflection.model_validate(LLMBase.format_llm_response(response))
+
+
+def parse_final_prompts(response: str) -> FinalPrompts:
+    return FinalPrompts.model_validate(LLMBase.format_llm_response(response))
+
+
+class Stage(BaseModel):
+    """
+    流水线中的一个阶段：一次 LLM 调用，由提示词模板、解析器和依赖关系声明。
+    模板使用 str.format 语法，可引用输入字段及所依赖阶段的输出（以阶段名为键）。
+    期望每次返回不同创作内容的阶段（如 elements 的"重新生成"）应声明 cacheable=False。
+    """
+    name: str
+    system_prompt: str
+    user_prompt: str
+    depends_on: List[str] = []
+    parser: Optional[Callable[[str], Any]] = None
+    timeout: Optional[float] = 60.0
+    cacheable: bool = True
+    start_message: str = ""
+    success_message: str = ""
+    error_message: str = ""
+
+    def render(self, context: Dict[str, Any]) -> list:
+        values = {
+            key: value.model_dump(exclude_none=True) if isinstance(value, BaseModel) else value
+            for key, value in context.items()
+        }
+        try:
+            user_content = self.user_prompt.format(**values)
+        except KeyError as e:
+            raise ValueError(f"阶段 {self.name} 的提示词模板缺少输入：{e.args[0]}") from e
+        return [
+            {"role": "system", "content": self.system_prompt},
+            {"role": "user", "content": user_content}
+        ]
+
+
+class StageMetrics:
+    """单个阶段的调用计数与耗时统计。"""
+
+    def __init__(self):
+        self.calls = 0
+        self.cache_hits = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def record(self, elapsed_ms: float):
+        self.calls += 1
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+
+    def snapshot(self) -> dict:
+        return {
+            "calls": self.calls,
+            "cache_hits": self.cache_hits,
+            "errors": self.errors,
+            "timeouts": self.timeouts,
+            "avg_ms": round(self.total_ms / self.calls, 1) if self.calls else 0.0,
+            "max_ms": round(self.max_ms, 1)
+        }
+
+
+class StageCache:
+    """按提示词内容缓存阶段结果的 LRU 缓存，带过期时间。"""
+
+    def __init__(self, max_entries: int = 256, ttl: Optional[float] = 3600.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+
+    def get(self, key: str) -> Tuple[bool, Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return False, None
+        stored_at, value = entry
+        if self.ttl is not None and time.monotonic() - stored_at > self.ttl:
+            del self._entries[key]
+            return False, None
+        self._entries.move_to_end(key)
+        return True, value
+
+    def set(self, key: str, value: Any):
+        self._entries[key] = (time.monotonic(), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+class Pipeline:
+    """
+    按依赖关系（DAG）执行阶段的引擎。互不依赖的阶段并发执行，
+    缓存、超时和指标统一在此处理。
+    """
+
+    def __init__(self, name: str, stages: List[Stage], llm: LLMBase, cache: Optional[StageCache] = None):
+        self.name = name
+        self.stages = {stage.name: stage for stage in stages}
+        if len(self.stages) != len(stages):
+            raise ValueError(f"流水线 {name} 中存在重名阶段")
+        self.llm = llm
+        self.cache = cache
+        self.order = self._topological_order()
+        self._metrics = {stage_name: StageMetrics() for stage_name in self.order}
+        # 日志记录的文件和行号指向声明这些阶段的创作者类
+        self._source_file = inspect.getfile(type(llm))
+        try:
+            self._source_line = inspect.getsourcelines(type(llm))[1]
+        except (OSError, TypeError):
+            self._source_line = 0
+
+    def _topological_order(self) -> List[str]:
+        order: List[str] = []
+        visiting = set()
+
+        def visit(stage_name: str):
+            if stage_name in order:
+                return
+            if stage_name in visiting:
+                raise ValueError(f"流水线 {self.name} 的阶段依赖存在环：{stage_name}")
+            if stage_name not in self.stages:
+                raise ValueError(f"流水线 {self.name} 中未定义阶段：{stage_name}")
+            visiting.add(stage_name)
+            for dependency in self.stages[stage_name].depends_on:
+                visit(dependency)
+            visiting.discard(stage_name)
+            order.append(stage_name)
+
+        for stage_name in self.stages:
+            visit(stage_name)
+        return order
+
+    def _plan(self, targets: Optional[List[str]], provided: Dict[str, Any]) -> List[str]:
+        # 只运行目标阶段及其缺失的依赖；输入中已提供的阶段输出直接复用
+        needed = set()
+
+        def require(stage_name: str):
+            if stage_name in needed or stage_name in provided:
+                return
+            if stage_name not in self.stages:
+                raise ValueError(f"流水线 {self.name} 中未定义阶段：{stage_name}")
+            needed.add(stage_name)
+            for dependency in self.stages[stage_name].depends_on:
+                require(dependency)
+
+        for stage_name in targets or self.order:
+            require(stage_name)
+        return [stage_name for stage_name in self.order if stage_name in needed]
+
+    def _cache_key(self, stage: Stage, messages: list) -> str:
+        raw = json.dumps([self.name, stage.name, self.llm.config.model, messages], ensure_ascii=False, default=str)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _log(self, level: int, stage: Stage, message: str, exc_info: bool = False):
+        # 日志记录归属到创作者模块及阶段名，使日志中的 module/funcName 能区分不同创作者和阶段
+        logger = self.llm.logger
+        if not logger.isEnabledFor(level):
+            return
+        record = logger.makeRecord(
+            logger.name, level, self._source_file, self._source_line, message, None,
+            sys.exc_info() if exc_info else None, func=stage.name
+        )
+        logger.handle(record)
+
+    async def _run_stage(self, stage: Stage, context: Dict[str, Any]) -> Any:
+        metrics = self._metrics[stage.name]
+        messages = stage.render(context)
+
+        key = None
+        if stage.cacheable and self.cache is not None:
+            key = self._cache_key(stage, messages)
+            hit, value = self.cache.get(key)
+            if hit:
+                metrics.cache_hits += 1
+                self._log(logging.INFO, stage, f"阶段 {self.name}.{stage.name} 命中缓存")
+                return value
+
+        if stage.start_message:
+            self._log(logging.INFO, stage, stage.start_message.format(**context))
+        started = time.perf_counter()
+        try:
+            # 截止时间交给负载均衡器，由上游请求超时先触发（计入熔断并决定是否重试）；
+            # asyncio.timeout 只作兜底，且不像 wait_for 那样为每次调用额外创建任务
+            deadline, backstop = None, None
+            if stage.timeout is not None:
+                deadline, backstop = time.monotonic() + stage.timeout, stage.timeout + STAGE_TIMEOUT_GRACE
+            async with asyncio.timeout(backstop):
+                response = await self.llm.call_llm(messages, stage=f"{self.name}.{stage.name}", deadline=deadline)
+            result = stage.parser(response) if stage.parser else response
+        except (asyncio.TimeoutError, httpx.TimeoutException):
+            metrics.timeouts += 1
+            self._log(logging.ERROR, stage, f"{stage.error_message or stage.name}：超过 {stage.timeout} 秒未完成")
+            raise
+        except Exception as e:
+            metrics.errors += 1
+            self._log(logging.ERROR, stage, f"{stage.error_message or stage.name}：{e}", exc_info=True)
+            raise
+        finally:
+            metrics.record((time.perf_counter() - started) * 1000)
+
+        if stage.success_message:
+            self._log(logging.INFO, stage, stage.success_message.format(**context, response=response))
+        if key is not None and is_complete(result):
+            self.cache.set(key, result)
+        return result
+
+    async def run(self, inputs: Dict[str, Any], targets: Optional[List[str]] = None) -> Dict[str, Any]:
+        """
+        运行目标阶段（默认全部阶段），返回包含输入及各阶段输出的上下文。
+        """
+        context = dict(inputs)
+        plan = self._plan(targets, inputs)
+        if len(plan) == 1:
+            # 接口通常只运行一个阶段（依赖由请求提供），直接执行，免去任务调度开销
+            context[plan[0]] = await self._run_stage(self.stages[plan[0]], context)
+            return context
+        tasks: Dict[str, asyncio.Task] = {}
+
+        async def execute(stage: Stage) -> Any:
+            dependencies = [tasks[name] for name in stage.depends_on if name in tasks]
+            if dependencies:
+                await asyncio.gather(*dependencies)
+            context[stage.name] = await self._run_stage(stage, context)
+            return context[stage.name]
+
+        for stage_name in plan:
+            tasks[stage_name] = asyncio.ensure_future(execute(self.stages[stage_name]))
+
+        try:
+            await asyncio.gather(*tasks.values())
+        except BaseException:
+            for task in tasks.values():
+                task.cancel()
+            raise
+        return context
+
+    def metrics(self) -> dict:
+        return {stage_name: self._metrics[stage_name].snapshot() for stage_name in self.order}
+
+
+class PipelineCreator(LLMBase):
+    """
+    以阶段 DAG 声明创作流程的创作者基类。
+    子类只需声明 pipeline_name、stages 及字段默认值，即可获得三段式生成接口。
+    """
+    pipeline_name: str = ""
+    stages: List[Stage] = []
+    field_defaults: Dict[str, str] = {}
+
+    def __init__(self, config: LLMConfig, cache: Optional[StageCache] = None):
+        super().__init__(config)
+        self.pipeline = Pipeline(self.pipeline_name, self.stages, self, cache=cache if cache is not None else StageCache())
+
+    def build_context(self, input_data: BaseModel) -> Dict[str, Any]:
+        context = {}
+        for key, value in input_data.model_dump().items():
+            context[key] = value if value not in (None, "") else self.field_defaults.get(key, "未指定")
+        return context
+
+    async def generate_elements(self, input_data: BaseModel) -> str:
+        result = await self.pipeline.run(self.build_context(input_data), targets=["elements"])
+        return result["elements"]
+
+    async def reflect_on_elements(self, concept: str, elements: Union[str, Dict[str, Any]]) -> Reflection:
+        try:
+            result = await self.pipeline.run({"concept": concept, "elements": elements}, targets=["reflection"])
+            return result["reflection"]
+        except CircuitOpenError:
+            # 熔断时快速失败，交由接口层返回 503
+            raise
+        except Exception as e:
+            return Reflection(error="处理过程中出现未知错误", details=str(e))
+
+    def attach_payload(self, prompts: FinalPrompts, settings: Optional[BaseModel], target: Optional[str] = None) -> FinalPrompts:
+        """
+        用 LLM 生成的英文提示词和创作设定中的技术参数组装 SD 请求体。
+        技术参数是纯格式化工作，在本地完成，不再交给 LLM。
+        """
+        if settings is None or prompts.error:
+            return prompts
+        if not prompts.en:
+            # LLM 未按格式返回时英文提示词为空，组装出的请求体无法使用
+            return prompts.model_copy(update={"error": "LLM 未返回英文提示词，无法生成 SD 请求"})
+        target = target or DEFAULT_TARGET
+        # 阶段结果可能来自缓存，复制后再附加请求体
+        return prompts.model_copy(update={"target": target, "payload": build_payload(prompts.en, settings, target)})
+
+    async def generate_final_prompts(
+        self,
+        elements: Union[str, Dict[str, Any]],
+        settings: Optional[BaseModel] = None,
+        target: Optional[str] = None
+    ) -> FinalPrompts:
+        try:
+            result = await self.pipeline.run({"reflection": elements}, targets=["final_prompts"])
+            return self.attach_payload(result["final_prompts"], settings, target)
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            return FinalPrompts(error=str(e))
+
+    async def generate(self, input_data: BaseModel, target: Optional[str] = None) -> FinalPrompts:
+        try:
+            result = await self.pipeline.run(self.build_context(input_data))
+            return self.attach_payload(result["final_prompts"], input_data, target)
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            return FinalPrompts(error=str(e))
@@ -0,0 +1,222 @@
+import asyncio
+import time
+from typing import Awaitable, Callable, Optional, TypeVar
+
+import httpx
+
+T = TypeVar("T")
+
+
+class CircuitOpenError(Exception):
+    """熔断器处于打开状态时快速失败，不再请求上游。"""
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"上游 {name} 暂不可用，{retry_after:.0f} 秒后重试")
+        self.name = name
+        self.retry_after = retry_after
+
+
+def is_upstream_failure(error: BaseException) -> bool:
+    """429、5xx 以及超时、连接失败等传输错误视为上游过载或故障。"""
+    if isinstance(error, httpx.HTTPStatusError):
+        status = error.response.status_code
+        return status == 429 or status >= 500
+    return isinstance(error, (httpx.TransportError, asyncio.TimeoutError))
+
+
+class AdaptiveLimiter:
+    """
+    AIMD 自适应并发限制：请求成功且延迟低于阈值时加性增大并发上限，
+    遇到 429/5xx/超时或延迟超过阈值时乘性减小。
+    """
+
+    def __init__(
+        self,
+        initial_limit: float = 4,
+        min_limit: float = 1,
+        max_limit: float = 64,
+        latency_threshold: float = 30.0,
+        backoff_ratio: float = 0.5,
+        decrease_cooldown: float = 5.0
+    ):
+        self.limit = float(initial_limit)
+        self.min_limit = float(min_limit)
+        self.max_limit = float(max_limit)
+        self.latency_threshold = latency_threshold
+        self.backoff_ratio = backoff_ratio
+        self.decrease_cooldown = decrease_cooldown
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._condition = asyncio.Condition()
+
+    async def acquire(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < max(1, int(self.limit)))
+            self.in_flight += 1
+
+    async def release(self, latency: Optional[float], overloaded: bool):
+        """
+        归还并发名额并调整上限。latency 为 None 表示请求在延迟阈值内被取消，不参与调整。
+        """
+        async with self._condition:
+            saturated = self.in_flight >= int(self.limit)
+            self.in_flight -= 1
+            if latency is not None:
+                if overloaded or latency > self.latency_threshold:
+                    self._decrease()
+                elif saturated:
+                    # 只有在并发名额用满时才加性增大，避免空闲时上限无限增长
+                    self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+    def _decrease(self):
+        # 同一批并发请求同时失败时只减小一次
+        now = time.monotonic()
+        if now - self._last_decrease < self.decrease_cooldown:
+            return
+        self._last_decrease = now
+        self.limit = max(self.min_limit, self.limit * self.backoff_ratio)
+
+    def snapshot(self) -> dict:
+        return {
+            "limit": round(self.limit, 2),
+            "in_flight": self.in_flight,
+            "min_limit": self.min_limit,
+            "max_limit": self.max_limit
+        }
+
+
+class CircuitBreaker:
+    """
+    连续失败达到阈值后打开熔断器并快速失败；经过恢复时间后进入半开状态，
+    放行少量探测请求，探测成功则关闭，失败则重新打开。
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_threshold: int = 5, recovery_timeout: float = 30.0, half_open_max_calls: int = 1):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self.state = self.CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+        self._probes = 0
+
+    def before_call(self):
+        if self.state == self.OPEN:
+            elapsed = time.monotonic() - self._opened_at
+            if elapsed < self.recovery_timeout:
+                raise CircuitOpenError(self.name, self.recovery_timeout - elapsed)
+            self.state = self.HALF_OPEN
+            self._probes = 0
+        if self.state == self.HALF_OPEN:
+            if self._probes >= self.half_open_max_calls:
+                raise CircuitOpenError(self.name, self.recovery_timeout)
+            self._probes += 1
+
+    def ready(self) -> bool:
+        """不改变状态地判断此刻是否会放行请求，供负载均衡选择后端时使用。"""
+        if self.state == self.OPEN:
+            return time.monotonic() - self._opened_at >= self.recovery_timeout
+        if self.state == self.HALF_OPEN:
+            return self._probes < self.half_open_max_calls
+        return True
+
+    def half_open(self):
+        # 外部探测（如主动健康检查）表明上游已恢复时，不必等待恢复时间即可放行探测请求
+        if self.state == self.OPEN:
+            self.state = self.HALF_OPEN
+            self._probes = 0
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+        self._probes = 0
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            self.state = self.OPEN
+            self._opened_at = time.monotonic()
+            self._probes = 0
+
+    def record_cancelled(self):
+        # 被取消的探测请求不说明上游状况，只归还探测名额
+        if self.state == self.HALF_OPEN and self._probes > 0:
+            self._probes -= 1
+
+    def snapshot(self) -> dict:
+        return {"state": self.state, "consecutive_failures": self.failures}
+
+
+class UpstreamGuard:
+    """组合自适应并发限制与熔断器，包裹对同一上游的所有请求。"""
+
+    def __init__(self, name: str, limiter: AdaptiveLimiter, breaker: CircuitBreaker):
+        self.name = name
+        self.limiter = limiter
+        self.breaker = breaker
+
+    async def call(self, func: Callable[[], Awaitable[T]]) -> T:
+        self.breaker.before_call()
+        try:
+            await self.limiter.acquire()
+        except BaseException:
+            self.breaker.record_cancelled()
+            raise
+        started = time.monotonic()
+        latency = None
+        overloaded = False
+        try:
+            result = await func()
+            latency = time.monotonic() - started
+            self.breaker.record_success()
+            return result
+        except Exception as e:
+            latency = time.monotonic() - started
+            overloaded = is_upstream_failure(e)
+            if overloaded:
+                self.breaker.record_failure()
+            else:
+                # 上游已正常应答（如 400、响应格式错误），不计入熔断
+                self.breaker.record_success()
+            raise
+        finally:
+            if latency is None:
+                elapsed = time.monotonic() - started
+                if elapsed >= self.limiter.latency_threshold:
+                    # 外层超时取消了已超过延迟阈值的请求：上游很可能挂起，按过载失败计入
+                    latency, overloaded = elapsed, True
+                    self.breaker.record_failure()
+                else:
+                    self.breaker.record_cancelled()
+            await asyncio.shield(self.limiter.release(latency, overloaded))
+
+    def snapshot(self) -> dict:
+        return {**self.limiter.snapshot(), **self.breaker.snapshot()}
+
+
+def create_guard(
+    name: str,
+    initial_concurrency: int = 4,
+    min_concurrency: int = 1,
+    max_concurrency: int = 64,
+    latency_threshold: float = 30.0,
+    failure_threshold: int = 5,
+    recovery_timeout: float = 30.0
+) -> UpstreamGuard:
+    """
+    为一个上游创建 UpstreamGuard。每个负载均衡器为自己的后端各建一个，
+    同名后端在不同配置下（如不同的 API 地址或阈值）互不影响。
+    """
+    limiter = AdaptiveLimiter(
+        initial_limit=initial_concurrency,
+        min_limit=min_concurrency,
+        max_limit=max_concurrency,
+        latency_threshold=latency_threshold
+    )
+    breaker = CircuitBreaker(name, failure_threshold=failure_threshold, recovery_timeout=recovery_timeout)
+    return UpstreamGuard(name, limiter, breaker)
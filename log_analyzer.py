@@ -0,0 +1,333 @@
+"""
+从 logs/backend.log（及轮转出的 .1–.5 文件）重建各阶段延迟。
+
+按时间顺序流式读取日志，以 (module, funcName) 为键把开始行与成功/出错行配对，
+输出每个阶段、每个创作者的延迟分布、错误率，以及按时间、层级（api/llm）和创作者分桶的吞吐量。
+同一请求在 api 层（main 路由）和 llm 层（创作者阶段）各记一次，因此时间线按层级分开统计，不能相加。
+内存占用与日志长度无关：延迟用对数分桶直方图统计，未配对的开始事件有数量和时长上限。
+
+用法：
+    python log_analyzer.py                          # 分析 logs/backend.log 及其轮转文件，输出 JSON
+    python log_analyzer.py --format csv -o stages.csv
+    python log_analyzer.py --format csv --section timeline --bucket 86400
+"""
+import argparse
+import csv
+import json
+import math
+import os
+import re
+import sys
+from collections import deque
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+
+LINE_PATTERN = re.compile(
+    r'^(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}),(\d{3}) (DEBUG|INFO|WARNING|ERROR|CRITICAL) (\S+) (\S+) ?(.*)$'
+)
+
+# 各模块、函数名到阶段名的映射；覆盖流水线改造前后的函数名
+STAGE_ALIASES = {
+    "generate_elements": "elements",
+    "generate_portrait_elements": "elements",
+    "generate_sculpture_portrait_elements": "elements",
+    "reflect_on_elements": "reflection",
+    "reflect_on_portrait_elements": "reflection",
+    "reflect_on_sculpture_elements": "reflection",
+    "generate_final_prompts": "final_prompts",
+    "generate_final_portrait_prompts": "final_prompts",
+    "generate_final_sculpture_prompts": "final_prompts",
+}
+
+SUCCESS_PREFIXES = ("成功", "完成")
+IGNORED_MARKERS = ("命中缓存",)
+
+
+class LatencyHistogram:
+    """对数分桶的延迟直方图，相对误差约为 growth 的一半，内存占用有上限。"""
+
+    def __init__(self, growth: float = 1.05):
+        self.growth = growth
+        self._log_growth = math.log(growth)
+        self.buckets: Dict[int, int] = {}
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def add(self, value_ms: float):
+        index = math.ceil(math.log(max(value_ms, 1.0)) / self._log_growth)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.total += value_ms
+        self.min = min(self.min, value_ms)
+        self.max = max(self.max, value_ms)
+
+    def merge(self, other: "LatencyHistogram"):
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                return min(max(self.growth ** index, self.min), self.max)
+        return self.max
+
+    def summary(self) -> dict:
+        if not self.count:
+            return {"count": 0, "min_ms": None, "mean_ms": None, "p50_ms": None, "p90_ms": None, "p99_ms": None, "max_ms": None}
+        return {
+            "count": self.count,
+            "min_ms": round(self.min, 1),
+            "mean_ms": round(self.total / self.count, 1),
+            "p50_ms": round(self.percentile(0.5), 1),
+            "p90_ms": round(self.percentile(0.9), 1),
+            "p99_ms": round(self.percentile(0.99), 1),
+            "max_ms": round(self.max, 1)
+        }
+
+
+class StageStats:
+    def __init__(self, creator: str, layer: str, stage: str):
+        self.creator = creator
+        self.layer = layer
+        self.stage = stage
+        self.functions = set()
+        self.latency = LatencyHistogram()
+        self.errors = 0
+        self.unmatched_starts = 0
+        self.orphan_finishes = 0
+
+    def row(self) -> dict:
+        finished = self.latency.count
+        return {
+            "creator": self.creator,
+            "layer": self.layer,
+            "stage": self.stage,
+            "functions": "|".join(sorted(self.functions)),
+            **self.latency.summary(),
+            "errors": self.errors,
+            "error_rate": round(self.errors / finished, 4) if finished else None,
+            "unmatched_starts": self.unmatched_starts,
+            "orphan_finishes": self.orphan_finishes
+        }
+
+
+def rotated_files(path: str, backups: int = 5) -> List[str]:
+    """返回按时间从旧到新排列的轮转文件列表（.5 最旧，基础文件最新）。"""
+    candidates = [f"{path}.{index}" for index in range(backups, 0, -1)] + [path]
+    return [candidate for candidate in candidates if os.path.exists(candidate)]
+
+
+def read_events(paths: List[str]) -> Iterator[Tuple[float, str, str, str, str]]:
+    """逐行读取日志，产出 (时间戳, 级别, 模块, 函数, 消息)；跳过堆栈等续行。"""
+    for path in paths:
+        with open(path, encoding="utf-8", errors="replace") as log_file:
+            for line in log_file:
+                match = LINE_PATTERN.match(line)
+                if not match:
+                    continue
+                stamp, millis, level, module, function, message = match.groups()
+                timestamp = datetime.strptime(stamp, "%Y-%m-%d %H:%M:%S").timestamp() + int(millis) / 1000
+                yield timestamp, level, module, function, message
+
+
+def classify(level: str, message: str) -> Optional[str]:
+    if any(marker in message for marker in IGNORED_MARKERS):
+        return None
+    if level in ("ERROR", "CRITICAL", "WARNING") or "出错" in message:
+        return "error"
+    if message.startswith(SUCCESS_PREFIXES):
+        return "success"
+    return "start"
+
+
+def describe(module: str, function: str) -> Optional[Tuple[str, str, str]]:
+    """把 (module, funcName) 映射为 (创作者, 层级, 阶段)；与阶段无关的模块返回 None。"""
+    if module == "main":
+        layer = "api"
+        creator = "sculpture" if "sculpture" in function else "portrait"
+    elif module.endswith("_creator"):
+        layer = "llm"
+        creator = module[len("llm_"):] if module.startswith("llm_") else module
+        creator = creator[:-len("_creator")]
+    else:
+        return None
+    return creator, layer, STAGE_ALIASES.get(function, function)
+
+
+class Analyzer:
+    def __init__(self, bucket_seconds: int = 3600, max_span: float = 600.0, max_open: int = 1000):
+        self.bucket_seconds = bucket_seconds
+        self.max_span = max_span
+        self.max_open = max_open
+        self.lines = 0
+        self.first_timestamp: Optional[float] = None
+        self.last_timestamp: Optional[float] = None
+        self.stages: Dict[Tuple[str, str, str], StageStats] = {}
+        self.timeline: Dict[Tuple[int, str, str], Dict[str, int]] = {}
+        self._open: Dict[Tuple[str, str], deque] = {}
+
+    def _stats(self, module: str, function: str) -> Optional[StageStats]:
+        described = describe(module, function)
+        if described is None:
+            return None
+        if described not in self.stages:
+            self.stages[described] = StageStats(*described)
+        stats = self.stages[described]
+        stats.functions.add(f"{module}.{function}")
+        return stats
+
+    def _bucket(self, timestamp: float, stats: StageStats) -> Dict[str, int]:
+        key = (int(timestamp // self.bucket_seconds * self.bucket_seconds), stats.layer, stats.creator)
+        if key not in self.timeline:
+            self.timeline[key] = {"started": 0, "completed": 0, "errors": 0}
+        return self.timeline[key]
+
+    def feed(self, timestamp: float, level: str, module: str, function: str, message: str):
+        self.lines += 1
+        if self.first_timestamp is None:
+            self.first_timestamp = timestamp
+        self.last_timestamp = timestamp
+
+        kind = classify(level, message)
+        if kind is None:
+            return
+        stats = self._stats(module, function)
+        if stats is None:
+            return
+
+        key = (module, function)
+        pending = self._open.setdefault(key, deque())
+        # 丢弃超过最长时长的开始事件（进程重启或日志缺失导致永远不会配对）
+        while pending and timestamp - pending[0] > self.max_span:
+            pending.popleft()
+            stats.unmatched_starts += 1
+
+        if kind == "start":
+            if len(pending) >= self.max_open:
+                pending.popleft()
+                stats.unmatched_starts += 1
+            pending.append(timestamp)
+            self._bucket(timestamp, stats)["started"] += 1
+            return
+
+        if not pending:
+            stats.orphan_finishes += 1
+            return
+        # 并发请求无法从日志区分，按先进先出配对
+        started = pending.popleft()
+        stats.latency.add((timestamp - started) * 1000)
+        bucket = self._bucket(timestamp, stats)
+        bucket["completed"] += 1
+        if kind == "error":
+            stats.errors += 1
+            bucket["errors"] += 1
+
+    def finish(self):
+        for (module, function), pending in self._open.items():
+            stats = self._stats(module, function)
+            stats.unmatched_starts += len(pending)
+            pending.clear()
+
+    def stage_rows(self) -> List[dict]:
+        return [self.stages[key].row() for key in sorted(self.stages)]
+
+    def creator_rows(self) -> List[dict]:
+        merged: Dict[Tuple[str, str], StageStats] = {}
+        for (creator, layer, _), stats in sorted(self.stages.items()):
+            total = merged.setdefault((creator, layer), StageStats(creator, layer, "*"))
+            total.functions.update(stats.functions)
+            total.latency.merge(stats.latency)
+            total.errors += stats.errors
+            total.unmatched_starts += stats.unmatched_starts
+            total.orphan_finishes += stats.orphan_finishes
+        return [merged[key].row() for key in sorted(merged)]
+
+    def timeline_rows(self) -> List[dict]:
+        return [
+            {
+                "bucket_start": datetime.fromtimestamp(start).isoformat(),
+                "layer": layer,
+                "creator": creator,
+                **counts,
+                "throughput_per_min": round(counts["completed"] / (self.bucket_seconds / 60), 3)
+            }
+            for (start, layer, creator), counts in sorted(self.timeline.items())
+        ]
+
+    def report(self, files: List[str]) -> dict:
+        return {
+            "files": files,
+            "lines": self.lines,
+            "first_event": datetime.fromtimestamp(self.first_timestamp).isoformat() if self.first_timestamp else None,
+            "last_event": datetime.fromtimestamp(self.last_timestamp).isoformat() if self.last_timestamp else None,
+            "bucket_seconds": self.bucket_seconds,
+            "stages": self.stage_rows(),
+            "creators": self.creator_rows(),
+            "timeline": self.timeline_rows()
+        }
+
+
+def write_csv(rows: List[dict], output):
+    if not rows:
+        return
+    writer = csv.DictWriter(output, fieldnames=list(rows[0].keys()))
+    writer.writeheader()
+    writer.writerows(rows)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="从后端日志重建各阶段延迟、错误率与吞吐量")
+    parser.add_argument("paths", nargs="*", default=[os.path.join("logs", "backend.log")],
+                        help="日志文件路径，默认同时读取其 .1–.5 轮转文件")
+    parser.add_argument("--no-rotated", action="store_true", help="只读取指定的文件，不包含轮转文件")
+    parser.add_argument("--format", choices=["json", "csv"], default="json")
+    parser.add_argument("--section", choices=["stages", "creators", "timeline"], default="stages",
+                        help="CSV 输出的内容（JSON 输出包含全部内容）")
+    parser.add_argument("--bucket", type=int, default=3600, help="吞吐量时间分桶的秒数")
+    parser.add_argument("--max-span", type=float, default=600.0, help="开始事件等待配对的最长秒数")
+    parser.add_argument("-o", "--output", help="输出文件，默认写到标准输出")
+    args = parser.parse_args(argv)
+
+    files: List[str] = []
+    for path in args.paths:
+        files.extend([path] if args.no_rotated else rotated_files(path))
+    missing = [path for path in files if not os.path.exists(path)]
+    if not files or missing:
+        parser.error(f"找不到日志文件：{', '.join(missing or args.paths)}")
+
+    analyzer = Analyzer(bucket_seconds=args.bucket, max_span=args.max_span)
+    for event in read_events(files):
+        analyzer.feed(*event)
+    analyzer.finish()
+
+    output = open(args.output, "w", encoding="utf-8", newline="") if args.output else sys.stdout
+    try:
+        if args.format == "json":
+            json.dump(analyzer.report(files), output, ensure_ascii=False, indent=2)
+            output.write("\n")
+        else:
+            rows = {
+                "stages": analyzer.stage_rows,
+                "creators": analyzer.creator_rows,
+                "timeline": analyzer.timeline_rows
+            }[args.section]()
+            write_csv(rows, output)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
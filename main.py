@@ -1,18 +1,36 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from dotenv import load_dotenv
+from contextlib import asynccontextmanager
+import json
 import os
+from typing import Any, Dict, Literal, Optional, Union
 from pydantic import BaseModel, ValidationError
-import json
 from llm_base import LLMConfig
+from llm_pipeline import FinalPrompts, Reflection
+from llm_resilience import CircuitOpenError
 from llm_portrait_creator import PortraitCreator, PortraitSettings
 from llm_sculpture_creator import SculptureCreator, SculptureSettings
+from result_store import ResultStore, etag_matches
 from unified_logging import backend_logger as logger
 
 # 加载环境变量
 load_dotenv()
 
-app = FastAPI(title="Art Creation Assistant API", version="1.0.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 两个创作者共用同一配置，因此共用一个负载均衡器
+    if llm_config.health_check_interval > 0:
+        portrait_creator.balancer.start_health_checks(llm_config.health_check_interval)
+    yield
+    await portrait_creator.balancer.close()
+
+app = FastAPI(
+    title="Art Creation Assistant API",
+    version="1.0.0",
+    lifespan=lifespan
+)
 
 # 配置CORS
 app.add_middleware(
@@ -21,10 +39,31 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],  # 允许所有方法
     allow_headers=["*"],  # 允许所有头
+    expose_headers=["Location", "ETag"],  # 允许前端读取结果资源地址
 )
 
-# 创建LLMConfig实例
-llm_config = LLMConfig(api_key=os.getenv("OPENROUTER_API_KEY"))
+# 对超过阈值的响应（如元素描述、反思结果）启用 gzip 压缩
+GZIP_MINIMUM_SIZE = int(os.getenv("GZIP_MINIMUM_SIZE", "1024"))
+app.add_middleware(GZipMiddleware, minimum_size=GZIP_MINIMUM_SIZE)
+
+# 创建LLMConfig实例；LLM_BACKENDS 为 JSON 数组，未设置时只使用 OpenRouter
+llm_config = LLMConfig(
+    api_key=os.getenv("OPENROUTER_API_KEY"),
+    backends=json.loads(os.getenv("LLM_BACKENDS", "[]")),
+    stage_routes=json.loads(os.getenv("LLM_STAGE_ROUTES", "{}")),
+    routing_strategy=os.getenv("LLM_ROUTING_STRATEGY", "least_outstanding")
+)
+
+# 已完成的生成结果按内容哈希保存，通过 GET /api/results/{digest} 提供可缓存的访问
+result_store = ResultStore(
+    max_entries=int(os.getenv("RESULT_STORE_MAX_ENTRIES", "1024")),
+    directory=os.getenv("RESULT_STORE_DIR") or None
+)
+RESULT_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+def result_etag(digest: str) -> str:
+    # GZipMiddleware 可能压缩响应体，同一 ETag 对应不同编码的内容，因此使用弱 ETag
+    return f'W/"{digest}"'
 
 # 创建PortraitCreator实例
 portrait_creator = PortraitCreator(llm_config)
@@ -32,112 +71,171 @@ portrait_creator = PortraitCreator(llm_config)
 # 创建SculptureCreator实例
 sculpture_creator = SculptureCreator(llm_config)
 
-def clean_json_string(json_str):
-    # 查找第一个 '{' 和最后一个 '}'，���保留这之间的内容
-    start = json_str.find('{')
-    end = json_str.rfind('}') + 1
-    if start != -1 and end != -1:
-        return json_str[start:end]
-    return json_str
+class ReflectRequest(BaseModel):
+    concept: str = ""
+    elements: Union[str, Dict[str, Any]] = ""
+
+class FinalPromptsRequest(BaseModel):
+    elements: Union[str, Dict[str, Any]]
+    # 提供创作设定时，响应中附带按 target 格式组装好的 SD 请求体
+    target: Optional[Literal["a1111", "comfyui", "stability"]] = None
+
+class FinalPortraitPromptsRequest(FinalPromptsRequest):
+    settings: Optional[PortraitSettings] = None
+
+class FinalSculpturePromptsRequest(FinalPromptsRequest):
+    settings: Optional[SculptureSettings] = None
+
+class ElementsResponse(BaseModel):
+    elements: str
+
+class ReflectionResponse(BaseModel):
+    reflection: Reflection
+
+class FinalPromptsResponse(BaseModel):
+    prompts: Optional[FinalPrompts] = None
+    error: Optional[str] = None
+
+def circuit_open_exception(e: CircuitOpenError) -> HTTPException:
+    # 上游熔断期间返回 503，并告知客户端何时重试
+    return HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(int(e.retry_after) + 1)})
+
+def result_response(model: BaseModel) -> Response:
+    # 保存已完成的结果，并通过 Location 指向可被浏览器和 CDN 缓存的 GET 资源；
+    # 调用方只对按格式解析成功的结果调用，出错或原始内容回退的结果不应被永久缓存。
+    # 其余响应由 response_model 经 pydantic 直接序列化；这里同样直接序列化，使保存的内容与响应体一致
+    body = model.model_dump_json(exclude_none=True).encode("utf-8")
+    digest = result_store.put(body)
+    response = Response(content=body, media_type="application/json")
+    response.headers["Location"] = f"/api/results/{digest}"
+    response.headers["ETag"] = result_etag(digest)
+    return response
 
 
 @app.get("/health")
 async def health_check():
     return {"status": "healthy"}
 
+@app.get("/api/results/{digest}")
+async def get_result(digest: str, request: Request):
+    body = result_store.get(digest)
+    if body is None:
+        raise HTTPException(status_code=404, detail="结果不存在或已过期")
+    headers = {"ETag": result_etag(digest), "Cache-Control": RESULT_CACHE_CONTROL}
+    if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        # 304 须带上 200 响应会有的 Vary；GZipMiddleware 只给达到压缩阈值的响应添加 Accept-Encoding
+        if len(body) >= GZIP_MINIMUM_SIZE:
+            headers["Vary"] = "Accept-Encoding"
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+@app.get("/api/metrics")
+async def pipeline_metrics():
+    return {
+        "portrait": portrait_creator.pipeline.metrics(),
+        "sculpture": sculpture_creator.pipeline.metrics(),
+        "backends": portrait_creator.balancer.snapshot()
+    }
+
 # 肖像画 Prompt 生成器
-@app.post("/api/generate-portrait-elements")
+@app.post("/api/generate-portrait-elements", response_model=ElementsResponse, response_model_exclude_none=True)
 async def generate_portrait_elements(portrait: PortraitSettings):
     try:
         logger.info(f"收到生成肖像元素的请求：{portrait}")
         elements = await portrait_creator.generate_elements(portrait)
         logger.info(f"成功生成肖像元素")
-        return {"elements": elements}
+        response = ElementsResponse(elements=elements)
+        return result_response(response) if elements else response
     except ValidationError as e:
         logger.error(f"输入数据验证错误：{str(e)}")
         raise HTTPException(status_code=422, detail=f"无效的输入数据：{str(e)}")
+    except CircuitOpenError as e:
+        logger.warning(f"上游熔断，拒绝生成肖像元素：{str(e)}")
+        raise circuit_open_exception(e)
     except Exception as e:
         logger.error(f"生成肖像元素时出错：{str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/api/reflect-on-portrait-elements")
-async def reflect_on_portrait_elements(data: dict):
+@app.post("/api/reflect-on-portrait-elements", response_model=ReflectionResponse, response_model_exclude_none=True)
+async def reflect_on_portrait_elements(data: ReflectRequest):
     try:
         logger.info(f"收到反思请求：{data}")
-        concept = data.get('concept', '')
-        elements = data.get('elements', '')
-
-        reflected_elements = await portrait_creator.reflect_on_elements(concept, elements)
+        reflected_elements = await portrait_creator.reflect_on_elements(data.concept, data.elements)
         logger.info(f"成功反思画作描述")
 
-        return {"reflection": reflected_elements}
+        response = ReflectionResponse(reflection=reflected_elements)
+        return result_response(response) if reflected_elements.is_complete() else response
+    except CircuitOpenError as e:
+        logger.warning(f"上游熔断，拒绝反思画作描述：{str(e)}")
+        raise circuit_open_exception(e)
     except Exception as e:
         logger.error(f"反思画作描述时出错：{str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/api/generate-final-portrait-prompts")
-async def generate_final_portrait_prompts(data: dict):
+@app.post("/api/generate-final-portrait-prompts", response_model=FinalPromptsResponse, response_model_exclude_none=True)
+async def generate_final_portrait_prompts(data: FinalPortraitPromptsRequest):
     try:
         logger.info(f"收到生成最终提示词的请求：{data}")
-        prompts = await portrait_creator.generate_final_prompts(data['elements'])
+        prompts = await portrait_creator.generate_final_prompts(data.elements, data.settings, data.target)
         logger.info(f"成功生成最终提示词: {prompts}")
-
-        # 解析 JSON 字符串为 Python 字典
-        parsed_prompts = json.loads(prompts)
-        return {"prompts": parsed_prompts}
-    except json.JSONDecodeError as e:
-        logger.error(f"解析提示词 JSON 时出错：{str(e)}")
-        return {"error": "无效的提示词格式", "raw_prompts": prompts}
+        response = FinalPromptsResponse(prompts=prompts)
+        return result_response(response) if prompts.is_complete() else response
+    except CircuitOpenError as e:
+        logger.warning(f"上游熔断，拒绝生成最终提示词：{str(e)}")
+        raise circuit_open_exception(e)
     except Exception as e:
         logger.error(f"生成最终提示词时出错：{str(e)}", exc_info=True)
-        return {"error": str(e)}
+        return FinalPromptsResponse(error=str(e))
 
 # 雕塑 Prompt 生成器
-@app.post("/api/generate-sculpture-portrait-elements")
+@app.post("/api/generate-sculpture-portrait-elements", response_model=ElementsResponse, response_model_exclude_none=True)
 async def generate_sculpture_portrait_elements(sculpture: SculptureSettings):
     try:
         logger.info(f"收到生成雕塑元素的请求：{sculpture}")
         elements = await sculpture_creator.generate_elements(sculpture)
         logger.info(f"成功生成雕塑元素")
-        return {"elements": elements}
+        response = ElementsResponse(elements=elements)
+        return result_response(response) if elements else response
     except ValidationError as e:
         logger.error(f"输入数据验证错误：{str(e)}")
         raise HTTPException(status_code=422, detail=f"无效的输入数据：{str(e)}")
+    except CircuitOpenError as e:
+        logger.warning(f"上游熔断，拒绝生成雕塑元素：{str(e)}")
+        raise circuit_open_exception(e)
     except Exception as e:
         logger.error(f"生成雕塑元素时出错：{str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/api/reflect-on-sculpture-elements")
-async def reflect_on_sculpture_elements(data: dict):
+@app.post("/api/reflect-on-sculpture-elements", response_model=ReflectionResponse, response_model_exclude_none=True)
+async def reflect_on_sculpture_elements(data: ReflectRequest):
     try:
         logger.info(f"收到雕塑反思请求：{data}")
-        concept = data.get('concept', '')
-        elements = data.get('elements', '')
-
-        reflected_elements = await sculpture_creator.reflect_on_elements(concept, elements)
+        reflected_elements = await sculpture_creator.reflect_on_elements(data.concept, data.elements)
         logger.info(f"成功反思雕塑描述")
 
-        return {"reflection": reflected_elements}
+        response = ReflectionResponse(reflection=reflected_elements)
+        return result_response(response) if reflected_elements.is_complete() else response
+    except CircuitOpenError as e:
+        logger.warning(f"上游熔断，拒绝反思雕塑描述：{str(e)}")
+        raise circuit_open_exception(e)
     except Exception as e:
         logger.error(f"反思雕塑描述时出错：{str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/api/generate-final-sculpture-prompts")
-async def generate_final_sculpture_prompts(data: dict):
+@app.post("/api/generate-final-sculpture-prompts", response_model=FinalPromptsResponse, response_model_exclude_none=True)
+async def generate_final_sculpture_prompts(data: FinalSculpturePromptsRequest):
     try:
         logger.info(f"收到生成最终雕塑提示词的请求：{data}")
-        prompts = await sculpture_creator.generate_final_prompts(data['elements'])
+        prompts = await sculpture_creator.generate_final_prompts(data.elements, data.settings, data.target)
         logger.info(f"成功生成最终雕塑提示词: {prompts}")
-
-        # 解析 JSON 字符串为 Python 字典
-        parsed_prompts = json.loads(prompts)
-        return {"prompts": parsed_prompts}
-    except json.JSONDecodeError as e:
-        logger.error(f"解析雕塑提示词 JSON 时出错：{str(e)}")
-        return {"error": "无效的雕塑提示词格式", "raw_prompts": prompts}
+        response = FinalPromptsResponse(prompts=prompts)
+        return result_response(response) if prompts.is_complete() else response
+    except CircuitOpenError as e:
+        logger.warning(f"上游熔断，拒绝生成最终雕塑提示词：{str(e)}")
+        raise circuit_open_exception(e)
     except Exception as e:
         logger.error(f"生成最终雕塑提示词时出错：{str(e)}", exc_info=True)
-        return {"error": str(e)}
+        return FinalPromptsResponse(error=str(e))
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,66 @@
+import hashlib
+import os
+import re
+from collections import OrderedDict
+from typing import Optional
+
+DIGEST_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+
+class ResultStore:
+    """
+    按内容哈希保存已完成的生成结果（序列化后的响应体）。
+    内容寻址的结果永不改变，因此可以被浏览器和 CDN 永久缓存。
+    内存中保留最近的结果；配置目录后同时写入磁盘，供多个进程共享并在重启后保留。
+    """
+
+    def __init__(self, max_entries: int = 1024, directory: Optional[str] = None):
+        self.max_entries = max_entries
+        self.directory = directory
+        self._entries: "OrderedDict[str, bytes]" = OrderedDict()
+        if directory:
+            # 多个 worker 可能同时启动，exist_ok 避免创建目录时的竞争
+            os.makedirs(directory, exist_ok=True)
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.directory, f"{digest}.json")
+
+    def _remember(self, digest: str, body: bytes):
+        self._entries[digest] = body
+        self._entries.move_to_end(digest)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def put(self, body: bytes) -> str:
+        digest = hashlib.sha256(body).hexdigest()
+        self._remember(digest, body)
+        if self.directory and not os.path.exists(self._path(digest)):
+            # 先写临时文件再原子替换，避免其他进程读到写了一半的结果
+            temp_path = f"{self._path(digest)}.{os.getpid()}.tmp"
+            with open(temp_path, "wb") as result_file:
+                result_file.write(body)
+            os.replace(temp_path, self._path(digest))
+        return digest
+
+    def get(self, digest: str) -> Optional[bytes]:
+        if not DIGEST_PATTERN.match(digest):
+            return None
+        body = self._entries.get(digest)
+        if body is not None:
+            self._entries.move_to_end(digest)
+            return body
+        if self.directory and os.path.exists(self._path(digest)):
+            with open(self._path(digest), "rb") as result_file:
+                body = result_file.read()
+            self._remember(digest, body)
+            return body
+        return None
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """判断 If-None-Match 是否命中当前 ETag（弱比较，支持列表和 *）。"""
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    opaque = etag.removeprefix("W/")
+    return "*" in candidates or any(candidate.removeprefix("W/") == opaque for candidate in candidates)
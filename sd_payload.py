@@ -0,0 +1,158 @@
+import hashlib
+import os
+import re
+from typing import Any, Callable, Dict, Optional
+
+from pydantic import BaseModel
+
+DEFAULT_WIDTH = 1024
+DEFAULT_HEIGHT = 1024
+SIZE_PATTERN = re.compile(r'^\s*(\d+)\s*[xX×]\s*(\d+)\s*$')
+
+
+# ComfyUI 默认文生图工作流使用的模型文件和采样设置
+COMFYUI_CHECKPOINT = os.getenv("COMFYUI_CHECKPOINT", "v1-5-pruned-emaonly.safetensors")
+COMFYUI_SAMPLER = "euler"
+COMFYUI_SCHEDULER = "normal"
+
+
+class SDParameters(BaseModel):
+    """从创作设定中提取的 Stable Diffusion 技术参数，由本地确定性组装，无需 LLM 参与。"""
+    # 正数为固定 seed；-1 表示随机（前端默认发送 0，同样视为随机）
+    seed: int = -1
+    width: int = DEFAULT_WIDTH
+    height: int = DEFAULT_HEIGHT
+    steps: int = 40
+    samples: int = 1
+    cfg_scale: float = 7.0
+    # Stability 的风格预设 ID（如 "digital-art"），只用于 stability 格式
+    style_preset: Optional[str] = None
+    negative_prompt: str = ""
+
+    @classmethod
+    def from_settings(cls, settings: BaseModel) -> "SDParameters":
+        values = settings.model_dump()
+        # 只有形如 "1024x1024" 的 size 才是图像尺寸；雕塑设定中的 size 是实物尺寸
+        width, height = DEFAULT_WIDTH, DEFAULT_HEIGHT
+        match = SIZE_PATTERN.match(str(values.get("size") or ""))
+        if match:
+            width, height = int(match.group(1)), int(match.group(2))
+        defaults = cls()
+        return cls(
+            seed=values["seed"] if (values.get("seed") or 0) > 0 else defaults.seed,
+            width=width,
+            height=height,
+            steps=values.get("steps") or defaults.steps,
+            samples=values.get("samples") or defaults.samples,
+            cfg_scale=values.get("cfg_scale") or defaults.cfg_scale,
+            style_preset=values.get("style_preset") or None,
+            negative_prompt=values.get("negativePrompt") or ""
+        )
+
+    def resolved_seed(self, prompt: str) -> int:
+        # 不接受 -1 的目标（ComfyUI）改用由提示词导出的固定 seed，保证结果可复现
+        if self.seed > 0:
+            return self.seed
+        digest = hashlib.sha256(prompt.encode("utf-8")).digest()
+        return int.from_bytes(digest[:4], "big")
+
+
+def build_a1111_payload(prompt: str, params: SDParameters) -> Dict[str, Any]:
+    """AUTOMATIC1111 WebUI /sdapi/v1/txt2img 请求体。"""
+    # style_preset 是 Stability 的预设 ID，与 A1111 中用户保存的 styles 无关，因此不传递
+    return {
+        "prompt": prompt,
+        "negative_prompt": params.negative_prompt,
+        "seed": params.seed,
+        "steps": params.steps,
+        "cfg_scale": params.cfg_scale,
+        "width": params.width,
+        "height": params.height,
+        "batch_size": params.samples,
+        "n_iter": 1
+    }
+
+
+def build_comfyui_prompt(prompt: str, params: SDParameters) -> Dict[str, Any]:
+    """
+    ComfyUI /prompt 请求体：默认文生图工作流的 API 格式，节点编号与 ComfyUI 导出的默认工作流一致。
+    """
+    return {
+        "prompt": {
+            "3": {
+                "class_type": "KSampler",
+                "inputs": {
+                    "seed": params.resolved_seed(prompt),
+                    "steps": params.steps,
+                    "cfg": params.cfg_scale,
+                    "sampler_name": COMFYUI_SAMPLER,
+                    "scheduler": COMFYUI_SCHEDULER,
+                    "denoise": 1.0,
+                    "model": ["4", 0],
+                    "positive": ["6", 0],
+                    "negative": ["7", 0],
+                    "latent_image": ["5", 0]
+                }
+            },
+            "4": {
+                "class_type": "CheckpointLoaderSimple",
+                "inputs": {"ckpt_name": COMFYUI_CHECKPOINT}
+            },
+            "5": {
+                "class_type": "EmptyLatentImage",
+                "inputs": {"width": params.width, "height": params.height, "batch_size": params.samples}
+            },
+            "6": {
+                "class_type": "CLIPTextEncode",
+                "inputs": {"text": prompt, "clip": ["4", 1]}
+            },
+            "7": {
+                "class_type": "CLIPTextEncode",
+                "inputs": {"text": params.negative_prompt, "clip": ["4", 1]}
+            },
+            "8": {
+                "class_type": "VAEDecode",
+                "inputs": {"samples": ["3", 0], "vae": ["4", 2]}
+            },
+            "9": {
+                "class_type": "SaveImage",
+                "inputs": {"filename_prefix": "ComfyUI", "images": ["8", 0]}
+            }
+        }
+    }
+
+
+def build_stability_payload(prompt: str, params: SDParameters) -> Dict[str, Any]:
+    """Stability AI v1 text-to-image 请求体。"""
+    text_prompts = [{"text": prompt, "weight": 1}]
+    if params.negative_prompt:
+        text_prompts.append({"text": params.negative_prompt, "weight": -1})
+    payload = {
+        "text_prompts": text_prompts,
+        "cfg_scale": params.cfg_scale,
+        "width": params.width,
+        "height": params.height,
+        "samples": params.samples,
+        "steps": params.steps,
+        # Stability 以 0 表示随机
+        "seed": params.seed if params.seed > 0 else 0
+    }
+    if params.style_preset:
+        payload["style_preset"] = params.style_preset
+    return payload
+
+
+PAYLOAD_BUILDERS: Dict[str, Callable[[str, SDParameters], Dict[str, Any]]] = {
+    "a1111": build_a1111_payload,
+    "comfyui": build_comfyui_prompt,
+    "stability": build_stability_payload
+}
+
+DEFAULT_TARGET = os.getenv("SD_PAYLOAD_TARGET", "a1111")
+
+
+def build_payload(prompt: str, settings: BaseModel, target: Optional[str] = None) -> Dict[str, Any]:
+    target = target or DEFAULT_TARGET
+    if target not in PAYLOAD_BUILDERS:
+        raise ValueError(f"不支持的 SD 请求格式：{target}")
+    return PAYLOAD_BUILDERS[target](prompt, SDParameters.from_settings(settings))
@@ -0,0 +1,193 @@
+import asyncio
+import random
+import time
+
+import httpx
+import pytest
+
+from llm_balancer import BackendState, LLMBackend, LoadBalancer
+from llm_base import LLMConfig, get_balancer
+from llm_resilience import AdaptiveLimiter, CircuitBreaker, UpstreamGuard
+
+
+class FakeUpstream:
+    """模拟一个兼容 OpenAI 接口的后端，可随时切换返回的状态码。"""
+
+    def __init__(self, name: str, status: int = 200):
+        self.name = name
+        self.status = status
+        self.error = None
+        self.calls = 0
+
+    def handle(self, request: httpx.Request) -> httpx.Response:
+        if request.url.path.endswith("/models"):
+            return httpx.Response(200 if self.status == 200 else 503, json={"data": []})
+        self.calls += 1
+        if self.error is not None:
+            raise self.error
+        if self.status != 200:
+            return httpx.Response(self.status, json={"error": "unavailable"})
+        return httpx.Response(200, json={"choices": [{"message": {"content": self.name}}]})
+
+
+def make_state(upstream: FakeUpstream, weight: float = 1.0, failure_threshold: int = 2) -> BackendState:
+    backend = LLMBackend(name=upstream.name, api_url=f"http://{upstream.name}/v1/chat/completions", model="m", weight=weight)
+    guard = UpstreamGuard(
+        upstream.name,
+        AdaptiveLimiter(initial_limit=4, decrease_cooldown=0.0),
+        CircuitBreaker(upstream.name, failure_threshold=failure_threshold, recovery_timeout=0.05)
+    )
+    state = BackendState(backend, guard, "key")
+    state._client = httpx.AsyncClient(transport=httpx.MockTransport(upstream.handle))
+    return state
+
+
+def make_balancer(*states: BackendState, **kwargs) -> LoadBalancer:
+    # 摘除阈值设得很高，使这些用例只考察熔断器本身
+    kwargs.setdefault("eject_threshold", 1000)
+    return LoadBalancer(list(states), **kwargs)
+
+
+@pytest.fixture(autouse=True)
+def fixed_seed():
+    random.seed(0)
+
+
+def test_retries_on_another_backend_after_5xx():
+    async def scenario():
+        bad, good = FakeUpstream("bad", status=503), FakeUpstream("good")
+        balancer = make_balancer(make_state(bad, weight=100.0, failure_threshold=1000), make_state(good))
+        results = [await balancer.complete([], stage="portrait.elements") for _ in range(10)]
+        assert results == ["good"] * 10
+        assert bad.calls > 0
+        await balancer.close()
+
+    asyncio.run(scenario())
+
+
+def test_client_error_is_not_retried():
+    async def scenario():
+        bad, good = FakeUpstream("bad", status=400), FakeUpstream("good")
+        balancer = make_balancer(make_state(bad, weight=1e6), make_state(good))
+        with pytest.raises(httpx.HTTPStatusError):
+            await balancer.complete([])
+        assert good.calls == 0
+        await balancer.close()
+
+    asyncio.run(scenario())
+
+
+def test_tripped_backend_is_probed_and_rejoins_pool():
+    async def scenario():
+        flaky, steady = FakeUpstream("flaky", status=500), FakeUpstream("steady")
+        flaky_state = make_state(flaky)
+        balancer = make_balancer(flaky_state, make_state(steady))
+
+        while flaky_state.guard.breaker.state != CircuitBreaker.OPEN:
+            assert await balancer.complete([]) == "steady"
+
+        flaky.status = 200
+        await asyncio.sleep(0.06)
+        calls_before = flaky.calls
+        results = [await balancer.complete([]) for _ in range(50)]
+        assert "flaky" in results
+        assert flaky.calls > calls_before
+        assert flaky_state.guard.breaker.state == CircuitBreaker.CLOSED
+        await balancer.close()
+
+    asyncio.run(scenario())
+
+
+def test_timeout_counts_as_failure_and_trips_breaker():
+    async def scenario():
+        slow, steady = FakeUpstream("slow"), FakeUpstream("steady")
+        slow.error = httpx.ReadTimeout("timed out")
+        slow_state = make_state(slow)
+        balancer = make_balancer(slow_state, make_state(steady))
+
+        while slow_state.guard.breaker.state != CircuitBreaker.OPEN:
+            assert await balancer.complete([]) == "steady"
+        assert slow_state.guard.limiter.limit < 4
+        assert not slow_state.available(0.0)
+        await balancer.close()
+
+    asyncio.run(scenario())
+
+
+def test_passing_health_check_half_opens_breaker():
+    async def scenario():
+        upstream = FakeUpstream("a", status=500)
+        state = make_state(upstream, failure_threshold=1)
+        state.guard.breaker.recovery_timeout = 60.0
+        balancer = make_balancer(state, make_state(FakeUpstream("b")))
+
+        state.guard.breaker.record_failure()
+        await balancer.check_health()
+        assert state.guard.breaker.state == CircuitBreaker.OPEN
+
+        upstream.status = 200
+        await balancer.check_health()
+        assert state.guard.breaker.state == CircuitBreaker.HALF_OPEN
+        assert state.available(0.0)
+        await balancer.close()
+
+    asyncio.run(scenario())
+
+
+def test_stage_routes_must_name_known_backends():
+    with pytest.raises(ValueError):
+        make_balancer(make_state(FakeUpstream("a")), stage_routes={"final_prompts": ["typo"]})
+
+
+def test_stage_routes_pin_stage_to_backend():
+    async def scenario():
+        a, b = FakeUpstream("a"), FakeUpstream("b")
+        balancer = make_balancer(make_state(a), make_state(b), stage_routes={"final_prompts": ["b"]})
+        results = [await balancer.complete([], stage="portrait.final_prompts") for _ in range(10)]
+        assert results == ["b"] * 10
+        await balancer.close()
+
+    asyncio.run(scenario())
+
+
+def test_request_timeout_is_capped_by_deadline():
+    async def scenario():
+        upstream = FakeUpstream("a")
+        timeouts = []
+        handle = upstream.handle
+
+        def record(request: httpx.Request) -> httpx.Response:
+            timeouts.append(request.extensions["timeout"]["read"])
+            return handle(request)
+
+        state = make_state(upstream)
+        state._client = httpx.AsyncClient(transport=httpx.MockTransport(record))
+        balancer = make_balancer(state)
+        await balancer.complete([])
+        await balancer.complete([], deadline=time.monotonic() + 2.0)
+        assert timeouts[0] == state.backend.timeout
+        assert 0 < timeouts[1] <= 2.0
+        await balancer.close()
+
+    asyncio.run(scenario())
+
+
+def test_retry_is_skipped_when_deadline_is_near():
+    async def scenario():
+        bad, good = FakeUpstream("bad", status=503), FakeUpstream("good")
+        balancer = make_balancer(make_state(bad, weight=1e6), make_state(good), min_retry_budget=5.0)
+        with pytest.raises(httpx.HTTPStatusError):
+            await balancer.complete([], deadline=time.monotonic() + 1.0)
+        assert good.calls == 0
+        assert await balancer.complete([], deadline=time.monotonic() + 30.0) == "good"
+        await balancer.close()
+
+    asyncio.run(scenario())
+
+
+def test_configs_with_same_backend_name_do_not_share_guards():
+    first = get_balancer(LLMConfig(api_key="key", api_url="http://one/v1/chat/completions", failure_threshold=2))
+    second = get_balancer(LLMConfig(api_key="key", api_url="http://two/v1/chat/completions", failure_threshold=7))
+    first_guard, second_guard = first.backends["default"].guard, second.backends["default"].guard
+    assert first_guard is not second_guard
+    assert (first_guard.breaker.failure_threshold, second_guard.breaker.failure_threshold) == (2, 7)
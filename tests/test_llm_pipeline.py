@@ -0,0 +1,141 @@
+import asyncio
+import time
+from typing import List, Optional
+
+import pytest
+
+from llm_base import LLMConfig
+from llm_pipeline import FinalPrompts, Pipeline, PipelineCreator, Stage, StageCache, parse_final_prompts
+
+
+class ScriptedCreator(PipelineCreator):
+    """按阶段名返回预设响应的创作者，记录每次 LLM 调用。"""
+    pipeline_name = "test"
+
+    def __init__(self, stages: List[Stage], replies: dict, delays: Optional[dict] = None):
+        self.stages = stages
+        super().__init__(LLMConfig(api_key="test"))
+        self.replies = replies
+        self.delays = delays or {}
+        self.calls: List[str] = []
+        self.deadlines: List[Optional[float]] = []
+        self.cancelled: List[str] = []
+
+    async def call_llm(self, messages: list, stage=None, deadline=None) -> str:
+        name = stage.rsplit(".", 1)[-1]
+        self.calls.append(name)
+        self.deadlines.append(deadline)
+        try:
+            await asyncio.sleep(self.delays.get(name, 0.0))
+        except asyncio.CancelledError:
+            self.cancelled.append(name)
+            raise
+        reply = self.replies[name]
+        if isinstance(reply, Exception):
+            raise reply
+        if isinstance(reply, list):
+            return reply.pop(0)
+        return reply
+
+
+def stage(name: str, depends_on: List[str] = (), **kwargs) -> Stage:
+    template = " ".join(f"{{{dependency}}}" for dependency in depends_on) or "{concept}"
+    return Stage(name=name, system_prompt=name, user_prompt=template, depends_on=list(depends_on), **kwargs)
+
+
+def test_topological_order_follows_dependencies():
+    creator = ScriptedCreator([stage("c", ["a", "b"]), stage("b", ["a"]), stage("a")], {})
+    assert creator.pipeline.order == ["a", "b", "c"]
+
+
+def test_cycles_and_unknown_dependencies_are_rejected():
+    with pytest.raises(ValueError, match="环"):
+        ScriptedCreator([stage("a", ["b"]), stage("b", ["a"])], {})
+    with pytest.raises(ValueError, match="missing"):
+        ScriptedCreator([stage("a", ["missing"])], {})
+
+
+def test_independent_stages_run_concurrently():
+    creator = ScriptedCreator([stage("a"), stage("b"), stage("c", ["a", "b"])], {"a": "A", "b": "B", "c": "C"}, delays={"a": 0.1, "b": 0.1})
+    started = time.monotonic()
+    result = asyncio.run(creator.pipeline.run({"concept": "x"}))
+    elapsed = time.monotonic() - started
+    assert (result["a"], result["b"], result["c"]) == ("A", "B", "C")
+    assert creator.calls[-1] == "c"
+    assert elapsed < 0.28
+
+
+def test_provided_stage_outputs_are_reused():
+    creator = ScriptedCreator([stage("a"), stage("b", ["a"])], {"a": "A", "b": "B"})
+    result = asyncio.run(creator.pipeline.run({"a": "given"}, targets=["b"]))
+    assert creator.calls == ["b"]
+    assert result["a"] == "given"
+
+
+def test_failure_cancels_sibling_stages():
+    creator = ScriptedCreator(
+        [stage("fails"), stage("slow")],
+        {"fails": RuntimeError("boom"), "slow": "S"},
+        delays={"slow": 1.0}
+    )
+
+    async def scenario():
+        with pytest.raises(RuntimeError, match="boom"):
+            await creator.pipeline.run({"concept": "x"})
+        await asyncio.sleep(0)
+
+    asyncio.run(scenario())
+    assert creator.cancelled == ["slow"]
+    assert creator.pipeline.metrics()["fails"]["errors"] == 1
+
+
+def test_stage_timeout_is_passed_down_as_deadline():
+    creator = ScriptedCreator([stage("a", timeout=60.0), stage("b", timeout=None)], {"a": "A", "b": "B"})
+    started = time.monotonic()
+    asyncio.run(creator.pipeline.run({"concept": "x"}))
+    deadlines = dict(zip(creator.calls, creator.deadlines))
+    assert started + 59 < deadlines["a"] <= time.monotonic() + 60
+    assert deadlines["b"] is None
+
+
+def test_only_complete_results_are_cached():
+    replies = {"final": ["Sorry, I cannot comply.", '{"en_prompt": "a cat", "zh_prompt": "猫"}', "unused"]}
+    creator = ScriptedCreator([stage("final", parser=parse_final_prompts)], replies)
+
+    async def scenario() -> List[FinalPrompts]:
+        return [(await creator.pipeline.run({"concept": "x"}))["final"] for _ in range(3)]
+
+    first, second, third = asyncio.run(scenario())
+    assert first.en == "" and not first.is_complete()
+    assert second.en == third.en == "a cat"
+    assert creator.calls == ["final", "final"]
+    assert creator.pipeline.metrics()["final"]["cache_hits"] == 1
+
+
+def test_uncacheable_stage_always_calls_llm():
+    creator = ScriptedCreator([stage("elements", cacheable=False)], {"elements": ["one", "two"]})
+
+    async def scenario():
+        return [(await creator.pipeline.run({"concept": "x"}))["elements"] for _ in range(2)]
+
+    assert asyncio.run(scenario()) == ["one", "two"]
+
+
+def test_cache_entries_expire():
+    cache = StageCache(ttl=0.01)
+    cache.set("key", "value")
+    assert cache.get("key") == (True, "value")
+    time.sleep(0.02)
+    assert cache.get("key") == (False, None)
+
+
+def test_missing_template_input_names_stage_and_key():
+    creator = ScriptedCreator([stage("a")], {"a": "A"})
+    with pytest.raises(ValueError, match="阶段 a .*concept"):
+        asyncio.run(creator.pipeline.run({}))
+
+
+def test_duplicate_stage_names_are_rejected():
+    creator = ScriptedCreator([stage("a")], {})
+    with pytest.raises(ValueError):
+        Pipeline("dup", [stage("a"), stage("a")], creator)
@@ -0,0 +1,142 @@
+import asyncio
+
+import httpx
+import pytest
+
+from llm_resilience import AdaptiveLimiter, CircuitBreaker, CircuitOpenError, UpstreamGuard
+
+
+def make_guard(latency_threshold: float = 30.0, failure_threshold: int = 2, recovery_timeout: float = 0.05) -> UpstreamGuard:
+    limiter = AdaptiveLimiter(initial_limit=4, latency_threshold=latency_threshold, decrease_cooldown=0.0)
+    breaker = CircuitBreaker("test", failure_threshold=failure_threshold, recovery_timeout=recovery_timeout)
+    return UpstreamGuard("test", limiter, breaker)
+
+
+def test_limiter_increases_additively_only_when_saturated():
+    async def scenario():
+        limiter = AdaptiveLimiter(initial_limit=2)
+        await limiter.acquire()
+        await limiter.release(0.1, overloaded=False)
+        assert limiter.limit == 2
+
+        await limiter.acquire()
+        await limiter.acquire()
+        await limiter.release(0.1, overloaded=False)
+        assert limiter.limit == 2.5
+        await limiter.release(0.1, overloaded=False)
+
+    asyncio.run(scenario())
+
+
+def test_limiter_decreases_multiplicatively_once_per_cooldown():
+    async def scenario():
+        limiter = AdaptiveLimiter(initial_limit=8, latency_threshold=1.0, decrease_cooldown=60.0)
+        for _ in range(2):
+            await limiter.acquire()
+        await limiter.release(0.1, overloaded=True)
+        assert limiter.limit == 4
+        # 同一批并发请求的第二次失败落在冷却期内，不再减小
+        await limiter.release(0.1, overloaded=True)
+        assert limiter.limit == 4
+
+    asyncio.run(scenario())
+
+
+def test_limiter_decreases_on_slow_response_and_respects_min_limit():
+    async def scenario():
+        limiter = AdaptiveLimiter(initial_limit=1.5, min_limit=1, latency_threshold=1.0, decrease_cooldown=0.0)
+        await limiter.acquire()
+        await limiter.release(5.0, overloaded=False)
+        assert limiter.limit == 1
+
+    asyncio.run(scenario())
+
+
+def test_breaker_opens_half_opens_and_closes():
+    async def scenario():
+        guard = make_guard()
+
+        async def fail():
+            raise httpx.ConnectError("down")
+
+        async def succeed():
+            return "ok"
+
+        for _ in range(2):
+            with pytest.raises(httpx.ConnectError):
+                await guard.call(fail)
+        assert guard.breaker.state == CircuitBreaker.OPEN
+        with pytest.raises(CircuitOpenError):
+            await guard.call(succeed)
+
+        await asyncio.sleep(0.06)
+        assert await guard.call(succeed) == "ok"
+        assert guard.breaker.state == CircuitBreaker.CLOSED
+
+    asyncio.run(scenario())
+
+
+def test_failed_half_open_probe_reopens_breaker():
+    async def scenario():
+        guard = make_guard(failure_threshold=1)
+
+        async def fail():
+            raise httpx.ReadTimeout("slow")
+
+        with pytest.raises(httpx.ReadTimeout):
+            await guard.call(fail)
+        await asyncio.sleep(0.06)
+        with pytest.raises(httpx.ReadTimeout):
+            await guard.call(fail)
+        assert guard.breaker.state == CircuitBreaker.OPEN
+
+    asyncio.run(scenario())
+
+
+def test_client_errors_do_not_trip_breaker():
+    async def scenario():
+        guard = make_guard(failure_threshold=1)
+        request = httpx.Request("POST", "http://upstream/v1/chat/completions")
+
+        async def bad_request():
+            raise httpx.HTTPStatusError("bad", request=request, response=httpx.Response(400, request=request))
+
+        with pytest.raises(httpx.HTTPStatusError):
+            await guard.call(bad_request)
+        assert guard.breaker.state == CircuitBreaker.CLOSED
+        assert guard.limiter.limit == 4
+
+    asyncio.run(scenario())
+
+
+def test_outer_timeout_past_latency_threshold_counts_as_failure():
+    async def scenario():
+        guard = make_guard(latency_threshold=0.02, failure_threshold=2)
+
+        async def hang():
+            await asyncio.sleep(10)
+
+        for _ in range(2):
+            with pytest.raises(asyncio.TimeoutError):
+                await asyncio.wait_for(guard.call(hang), 0.05)
+        assert guard.breaker.state == CircuitBreaker.OPEN
+        assert guard.limiter.limit < 4
+        assert guard.limiter.in_flight == 0
+
+    asyncio.run(scenario())
+
+
+def test_cancellation_within_latency_threshold_is_ignored():
+    async def scenario():
+        guard = make_guard(latency_threshold=10.0, failure_threshold=1)
+
+        async def hang():
+            await asyncio.sleep(10)
+
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(guard.call(hang), 0.02)
+        assert guard.breaker.state == CircuitBreaker.CLOSED
+        assert guard.limiter.limit == 4
+        assert guard.limiter.in_flight == 0
+
+    asyncio.run(scenario())
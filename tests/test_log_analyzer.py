@@ -0,0 +1,44 @@
+from log_analyzer import Analyzer, LatencyHistogram
+
+
+def feed_request(analyzer: Analyzer, started: float, error: bool = False):
+    """一次肖像反思请求：api 层的路由日志包着 llm 层的阶段日志。"""
+    analyzer.feed(started, "INFO", "main", "reflect_on_portrait_elements", "收到反思请求：...")
+    analyzer.feed(started + 0.1, "INFO", "llm_portrait_creator", "reflection", "反思肖像描述")
+    if error:
+        analyzer.feed(started + 2.0, "ERROR", "llm_portrait_creator", "reflection", "反思肖像描述时出错：boom")
+        analyzer.feed(started + 2.1, "ERROR", "main", "reflect_on_portrait_elements", "反思画作描述时出错：boom")
+    else:
+        analyzer.feed(started + 2.0, "INFO", "llm_portrait_creator", "reflection", "完成反思: {}")
+        analyzer.feed(started + 2.1, "INFO", "main", "reflect_on_portrait_elements", "成功反思画作描述")
+
+
+def test_timeline_counts_each_request_once_per_layer():
+    analyzer = Analyzer(bucket_seconds=60)
+    feed_request(analyzer, 0.0)
+    feed_request(analyzer, 10.0, error=True)
+    analyzer.finish()
+
+    rows = {(row["layer"], row["creator"]): row for row in analyzer.timeline_rows()}
+    assert set(rows) == {("api", "portrait"), ("llm", "portrait")}
+    for row in rows.values():
+        assert (row["started"], row["completed"], row["errors"]) == (2, 2, 1)
+        assert row["throughput_per_min"] == 2.0
+
+
+def test_stage_latency_pairs_start_and_finish():
+    analyzer = Analyzer()
+    feed_request(analyzer, 0.0)
+    analyzer.finish()
+    stages = {(row["layer"], row["stage"]): row for row in analyzer.stage_rows()}
+    assert stages[("llm", "reflection")]["count"] == 1
+    assert abs(stages[("llm", "reflection")]["mean_ms"] - 1900) < 1
+    assert stages[("api", "reflection")]["errors"] == 0
+
+
+def test_histogram_percentiles_stay_within_bucket_error():
+    histogram = LatencyHistogram()
+    for value in range(1, 1001):
+        histogram.add(float(value))
+    assert abs(histogram.percentile(0.5) - 500) / 500 < 0.05
+    assert histogram.percentile(1.0) == 1000
@@ -0,0 +1,40 @@
+from result_store import ResultStore, etag_matches
+
+
+def test_put_and_get_by_digest():
+    store = ResultStore()
+    digest = store.put(b'{"a":1}')
+    assert len(digest) == 64
+    assert store.get(digest) == b'{"a":1}'
+    assert store.get("0" * 64) is None
+    assert store.get("../../etc/passwd") is None
+
+
+def test_memory_store_evicts_least_recently_used():
+    store = ResultStore(max_entries=2)
+    first, second = store.put(b"1"), store.put(b"2")
+    store.get(first)
+    store.put(b"3")
+    assert store.get(first) == b"1"
+    assert store.get(second) is None
+
+
+def test_directory_is_shared_between_stores(tmp_path):
+    directory = tmp_path / "results"
+    writer = ResultStore(directory=str(directory))
+    # 目录已存在时（另一个 worker 先创建）也能正常初始化
+    reader = ResultStore(directory=str(directory))
+    digest = writer.put(b"shared")
+    assert reader.get(digest) == b"shared"
+    assert not [path for path in directory.iterdir() if path.suffix == ".tmp"]
+
+
+def test_etag_matching():
+    etag = 'W/"abc"'
+    assert etag_matches('W/"abc"', etag)
+    assert etag_matches('"abc"', etag)
+    assert etag_matches('"other", W/"abc"', etag)
+    assert etag_matches("*", etag)
+    assert not etag_matches('"other"', etag)
+    assert not etag_matches(None, etag)
+    assert not etag_matches("", etag)
@@ -0,0 +1,67 @@
+import json
+import os
+
+import pytest
+
+os.environ.setdefault("OPENROUTER_API_KEY", "test")
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+import main  # noqa: E402
+
+ORIGIN = {"Origin": "http://localhost:3000"}
+REFLECTION = json.dumps({"concept": "执着", "elements": {"subject": "坚定的眼神" * 200}}, ensure_ascii=False)
+
+
+def vary(response) -> set:
+    return {value.strip().lower() for value in response.headers.get("vary", "").split(",") if value.strip()}
+
+
+@pytest.fixture
+def client(monkeypatch):
+    replies = []
+
+    async def call_llm(messages, stage=None, deadline=None):
+        return replies.pop(0)
+
+    monkeypatch.setattr(main.portrait_creator, "call_llm", call_llm)
+    main.portrait_creator.pipeline.cache = None
+    test_client = TestClient(main.app)
+    test_client.replies = replies
+    return test_client
+
+
+def test_complete_result_is_stored_and_revalidated(client):
+    client.replies.append(REFLECTION)
+    created = client.post("/api/reflect-on-portrait-elements", json={"concept": "执着", "elements": "..."}, headers=ORIGIN)
+    assert created.status_code == 200
+    location, etag = created.headers["location"], created.headers["etag"]
+    assert etag.startswith('W/"')
+
+    fetched = client.get(location, headers=ORIGIN)
+    assert fetched.status_code == 200
+    assert fetched.json() == created.json()
+    assert fetched.headers["etag"] == etag
+    assert "immutable" in fetched.headers["cache-control"]
+
+    revalidated = client.get(location, headers={**ORIGIN, "If-None-Match": etag})
+    assert revalidated.status_code == 304
+    assert revalidated.headers["etag"] == etag
+    assert vary(revalidated) == vary(fetched)
+    assert "accept-encoding" in vary(fetched)
+
+
+def test_incomplete_results_are_not_stored(client):
+    client.replies.extend(["Sorry, I cannot comply.", "Sorry, I cannot comply."])
+    reflection = client.post("/api/reflect-on-portrait-elements", json={"concept": "执着", "elements": "..."})
+    assert reflection.status_code == 200
+    assert "location" not in reflection.headers
+    assert reflection.json()["reflection"]["raw"] == "Sorry, I cannot comply."
+
+    prompts = client.post("/api/generate-final-portrait-prompts", json={"elements": "..."})
+    assert "location" not in prompts.headers
+    assert prompts.json()["prompts"]["en"] == ""
+
+
+def test_unknown_result_is_404(client):
+    assert client.get("/api/results/" + "0" * 64).status_code == 404
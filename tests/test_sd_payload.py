@@ -0,0 +1,93 @@
+import pytest
+
+from llm_base import LLMConfig
+from llm_pipeline import FinalPrompts
+from llm_portrait_creator import PortraitCreator, PortraitSettings
+from llm_sculpture_creator import SculptureSettings
+from sd_payload import SDParameters, build_payload
+
+PROMPT = "portrait of a determined middle-aged asian man, pop art"
+
+
+def settings(**overrides) -> PortraitSettings:
+    values = {
+        "concept": "执着",
+        "negativePrompt": "blurry",
+        "size": "832x1216",
+        "steps": 30,
+        "samples": 1,
+        "cfg_scale": 6.5,
+        "style_preset": "digital-art"
+    }
+    values.update(overrides)
+    return PortraitSettings(**values)
+
+
+@pytest.mark.parametrize("seed", [0, -1, None])
+def test_unset_seed_is_random_for_every_target(seed):
+    params = SDParameters.from_settings(settings(seed=seed))
+    assert params.seed == -1
+    assert build_payload(PROMPT, settings(seed=seed), "a1111")["seed"] == -1
+    assert build_payload(PROMPT, settings(seed=seed), "stability")["seed"] == 0
+    comfy_seed = build_payload(PROMPT, settings(seed=seed), "comfyui")["prompt"]["3"]["inputs"]["seed"]
+    assert comfy_seed == params.resolved_seed(PROMPT) >= 0
+
+
+def test_fixed_seed_is_kept_for_every_target():
+    assert build_payload(PROMPT, settings(seed=42), "a1111")["seed"] == 42
+    assert build_payload(PROMPT, settings(seed=42), "stability")["seed"] == 42
+    assert build_payload(PROMPT, settings(seed=42), "comfyui")["prompt"]["3"]["inputs"]["seed"] == 42
+
+
+def test_a1111_payload():
+    payload = build_payload(PROMPT, settings(), "a1111")
+    assert payload["prompt"] == PROMPT
+    assert payload["negative_prompt"] == "blurry"
+    assert (payload["width"], payload["height"]) == (832, 1216)
+    assert (payload["steps"], payload["cfg_scale"], payload["batch_size"]) == (30, 6.5, 1)
+    # Stability 的风格预设不是 A1111 的 styles
+    assert "styles" not in payload
+
+
+def test_comfyui_payload_is_api_format_graph():
+    graph = build_payload(PROMPT, settings(), "comfyui")["prompt"]
+    assert {node["class_type"] for node in graph.values()} == {
+        "KSampler", "CheckpointLoaderSimple", "EmptyLatentImage", "CLIPTextEncode", "VAEDecode", "SaveImage"
+    }
+    sampler = graph["3"]["inputs"]
+    assert {"seed", "steps", "cfg", "sampler_name", "scheduler", "denoise", "model", "positive", "negative", "latent_image"} <= set(sampler)
+    assert graph[sampler["positive"][0]]["inputs"]["text"] == PROMPT
+    assert graph[sampler["negative"][0]]["inputs"]["text"] == "blurry"
+    assert graph[sampler["latent_image"][0]]["inputs"] == {"width": 832, "height": 1216, "batch_size": 1}
+    # 节点之间的引用都指向存在的节点
+    for node in graph.values():
+        for value in node["inputs"].values():
+            if isinstance(value, list):
+                assert value[0] in graph
+
+
+def test_stability_payload():
+    payload = build_payload(PROMPT, settings(), "stability")
+    assert payload["text_prompts"] == [{"text": PROMPT, "weight": 1}, {"text": "blurry", "weight": -1}]
+    assert payload["style_preset"] == "digital-art"
+    assert (payload["width"], payload["height"], payload["samples"]) == (832, 1216, 1)
+
+
+def test_sculpture_size_is_not_image_size():
+    params = SDParameters.from_settings(SculptureSettings(concept="x", size="真人大小"))
+    assert (params.width, params.height) == (1024, 1024)
+
+
+def test_unknown_target_is_rejected():
+    with pytest.raises(ValueError):
+        build_payload(PROMPT, settings(), "midjourney")
+
+
+def test_attach_payload_flags_empty_prompt_only_when_payload_requested():
+    creator = PortraitCreator(LLMConfig(api_key="test"))
+    unparsed = FinalPrompts(raw="Sorry, I cannot comply.")
+    assert creator.attach_payload(unparsed, None).error is None
+    flagged = creator.attach_payload(unparsed, settings(), "a1111")
+    assert flagged.error and flagged.payload is None
+    attached = creator.attach_payload(FinalPrompts(en=PROMPT), settings(), "a1111")
+    assert attached.target == "a1111" and attached.payload["prompt"] == PROMPT